@@ -1,6 +1,6 @@
 from crewai import Agent
 
-def get_agriculture_agent(knowledge_tool, llm):
+def get_agriculture_agent(knowledge_tool, llm, allow_delegation=True, verbose=True, max_iter=20):
     return Agent(
         role="🌾 Agriculture Expert",
         goal="""
@@ -23,6 +23,7 @@ Provide a weather-aware prevention and treatment strategy in the requested langu
         backstory="A farmer uploaded an image of a diseased plant. You use your knowledge of plant diseases and current weather to advise the farmer.",
         tools=[knowledge_tool],
         llm=llm,
-        allow_delegation=True,
-        verbose=True,
+        allow_delegation=allow_delegation,
+        verbose=verbose,
+        max_iter=max_iter,
     )
\ No newline at end of file
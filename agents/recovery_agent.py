@@ -1,10 +1,13 @@
 from crewai import Agent
 
-def get_recovery_agent(knowledge_tool, llm):
+def get_recovery_agent(knowledge_tool, llm, allow_delegation=False, verbose=False, max_iter=20):
     return Agent(
         role="🌿 Recovery Specialist",
         goal="After prevention and treatment, suggest fertilizers and nutrients to help the plant recover.",
         backstory="An expert in plant nutrition helping farmers after disease control.",
         tools=[knowledge_tool],
-        llm=llm
+        llm=llm,
+        allow_delegation=allow_delegation,
+        verbose=verbose,
+        max_iter=max_iter,
     )
\ No newline at end of file
@@ -1,45 +1,28 @@
 import patch_sqlite
 import streamlit as st
-from xhtml2pdf import pisa
-import io
-import numpy as np
-from PIL import Image
 import os
-import requests
-# from tensorflow.keras.models import load_model
-# from tensorflow.keras.layers import InputLayer
-from keras.models import load_model
-from keras.layers import InputLayer
+import sys
+import time
+import uuid
 from dotenv import load_dotenv
-from pydantic import PrivateAttr
-from langchain_groq import ChatGroq
-from langchain.docstore.document import Document
-from langchain.tools import Tool
-from crewai import Agent, Task, Crew
-from crewai.tools import BaseTool
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from langchain_openai import ChatOpenAI
-import openai
-import cassio
-from langchain.vectorstores.cassandra import Cassandra
-from langchain.embeddings import HuggingFaceEmbeddings
-from utils.email_utils import send_email
-from utils.pdf_utils import create_pdf
-from utils.weather_utils import get_weather
-from agents.agriculture_agent import get_agriculture_agent
-from agents.recovery_agent import get_recovery_agent
-from tasks.diagnosis_task import get_diagnosis_task
-from tasks.recovery_task import get_recovery_task
-from utils.astra_db_utils import get_astra_vectorstore, store_response, similarity_search
+from utils.weather_utils import weather_available
+from utils.image_utils import ingest_image
+from utils.inference_utils import model_signature, should_run_crews
+from utils.crew_utils import CrewRun, crew_inputs
+from utils.history_utils import image_hash, result_key
+from utils.outbox_utils import OUTBOX_PATH
+from services.diagnosis_service import DIAGNOSIS_QUEUE_TIMEOUT, ServiceBusy
+from utils import lazy_utils
+from utils import resource_utils as resources
+from utils import trace_utils
+
 # Load environment variables
 load_dotenv()
 
 # API Keys and configuration
 openai_api_key = os.getenv("OPENAI_API_KEY")
 groq_api_key = os.getenv("GROQ_API_KEY")
-weather_api = os.getenv("WEATHER_API_KEY")
+weather_api = weather_available()
 
 # Validate required API keys
 if not openai_api_key:
@@ -53,67 +36,37 @@ if not groq_api_key:
 if not weather_api:
     st.warning("Weather API key not found. Weather information will not be available.")
 
-# Initialize OpenAI
-openai.api_key = openai_api_key
-llm = ChatOpenAI(api_key=openai_api_key, model="gpt-4.1-mini")
-
-
-Astra_token = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
-Astra_DB_ID = os.getenv("ASTRA_DB_ID")
-# Simple Knowledge Base Tool (replaces Astra DB)
-class AstraSearchTool(BaseTool):
-    name: str = "Astra Search Tool"
-    description: str = "Retrieves plant disease treatments from Astra DB based on similarity."
-    _vectorstore = None
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._vectorstore = get_astra_vectorstore()
-
-    def _run(self, query: str) -> str:
-        return similarity_search(self._vectorstore, query, k=3)
-
-    def store_response(self, query: str, response):
-        store_response(self._vectorstore, query, response)
-        
-
-# Initialize tools
-knowledge_tool = AstraSearchTool()
-
-# Agent and Task definitions
-agriculture_agent = get_agriculture_agent(knowledge_tool, llm)
-recovery_agent = get_recovery_agent(knowledge_tool, llm)
-diagnosis_task = get_diagnosis_task(knowledge_tool, agriculture_agent)
-recovery_task = get_recovery_task(knowledge_tool, recovery_agent)
-
-# Weather API
-def get_weather(location):
-    if not weather_api:
-        return {"error": "Weather API key not configured"}
-    
-    try:
-        base_url = f"http://api.weatherapi.com/v1/current.json?key={weather_api}&q={location}&aqi=no"
-        response = requests.get(base_url, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Unable to fetch data: {response.status_code} - {response.text}"}
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Network error: {e}"}
-    except Exception as e:
-        return {"error": f"Unexpected error: {e}"}
-
-# Load the disease classification model
-try:
-    pathogen_model = load_model("pathogen_classifier.h5", compile=False, custom_objects={"InputLayer": InputLayer})
-    class_labels = ["Bacteria", "Fungus", "Healthy", "Pests", "Virus"]
-except Exception as e:
-    st.error(f"Failed to load model: {e}")
-    st.stop()
+# Model, vectorstore, LLM, agents and tasks are built once per process and reused across reruns
+# and shared with the HTTP API (services/http_api.py) when both run in one process.
+# They load in the background so the page renders before TensorFlow and CrewAI are imported.
+# Profiling mode (AGRIGPT_PROFILE=1 or `streamlit run app.py -- --profile`): per-stage memory deltas,
+# CPU samples and an allocation snapshot per rerun are written to PROFILE_DIR. Enabled before the
+# warm-up so model loading is captured too.
+if os.getenv("AGRIGPT_PROFILE") == "1" or "--profile" in sys.argv:
+    from utils import profile_utils
+    profile_utils.enable()
+    profile_utils.checkpoint("rerun")
+
+if not resources.is_loaded("recovery_task"):
+    resources.warm_up_async("classifier", "knowledge_tool", "diagnosis_task", "recovery_task")
+# Keeps the busiest locations' weather cached when WEATHER_PREFETCH_INTERVAL is set
+if weather_api:
+    resources.get("weather_prefetcher").start()
+# Reports a previous process left undelivered go out without waiting for a new one to be queued
+if os.path.exists(OUTBOX_PATH):
+    resources.get("email_outbox")
 
 # UI Starts
 st.set_page_config(page_title="🌿 AgriGPT", page_icon="🌱", layout="wide")
 
+# Past diagnoses are listed per browser session. The id stays server-side in the session state,
+# never in the URL, since anyone holding it could read that farmer's history and photos.
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+if "session" in st.query_params:
+    # Links from before the id left the URL
+    del st.query_params["session"]
+result_store = resources.get("result_store")
+
 # --- Adaptive Glassmorphism CSS & Animations ---
 st.markdown("""
 <style>
@@ -300,6 +253,19 @@ with st.sidebar:
         "<span style='font-size:0.95rem; color:var(--accent);'>💡 <b>Tip:</b> For best results, upload a clear image and provide accurate location.</span>",
         unsafe_allow_html=True,
     )
+    history = {entry["id"]: entry for entry in result_store.history(session_id)}
+    past_id = None
+    if history:
+        st.markdown("---")
+        past_id = st.selectbox(
+            "🕘 Past diagnoses",
+            [None, *history],
+            format_func=lambda entry_id: "—" if entry_id is None else (
+                f"{history[entry_id]['inputs'].get('predicted_class')} · "
+                f"{history[entry_id]['inputs'].get('name') or 'plant'} · "
+                f"{time.strftime('%d %b %H:%M', time.localtime(history[entry_id]['created_at']))}"
+            ),
+        )
 
 # --- Animated Stepper with progress bar ---
 step = 1
@@ -324,22 +290,43 @@ with st.container():
     st.write("Upload a plant image and enter your location to get instant diagnosis and recommendations.")
 
     if uploaded_file is not None:
+        # The same service the HTTP API uses; the model is usually already warmed up
         try:
-            img = Image.open(uploaded_file)
-            img = img.resize((150, 150))
-            img_array = np.array(img) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-
-            with st.spinner("🔎 Analyzing image..."):
-                progress = st.progress(0)
-                for i in range(1, 101, 10):
-                    progress.progress(i)
-                    import time; time.sleep(0.04)
-                predictions = pathogen_model.predict(img_array, verbose=0)
-                progress.progress(100)
-
-            predicted_class = class_labels[np.argmax(predictions)]
-            confidence = np.max(predictions) * 100
+            service = resources.get("diagnosis_service")
+            resources.get("classifier")
+        except Exception as e:
+            st.error(f"Failed to load model: {e}")
+            st.stop()
+
+        try:
+            # Only a small display JPEG and the prediction are kept per session; the full-resolution
+            # photo is decoded once and released straight away. Photos seen before, in any session,
+            # are not decoded or classified again.
+            digest = image_hash(uploaded_file.getbuffer())
+            upload = st.session_state.get("upload")
+            if upload is None or upload["hash"] != digest:
+                st.session_state.pop("upload", None)
+                prediction, thumbnail = result_store.get_prediction(digest, model_signature())
+                if prediction is None:
+                    image = ingest_image(uploaded_file)
+                    with st.spinner("🔎 Analyzing image..."):
+                        progress = st.progress(0)
+                        for i in range(1, 101, 10):
+                            progress.progress(i)
+                            time.sleep(0.04)
+                        # Concurrent sessions are micro-batched into one predict call, within
+                        # the same diagnosis slots the HTTP API takes
+                        with service.slot(DIAGNOSIS_QUEUE_TIMEOUT):
+                            prediction = service.classify_array(image.array)
+                        progress.progress(100)
+                    thumbnail = image.thumbnail
+                    result_store.put_prediction(digest, model_signature(), prediction, thumbnail)
+                upload = {"hash": digest, "thumbnail": thumbnail, "prediction": prediction}
+                st.session_state["upload"] = upload
+            prediction = upload["prediction"]
+
+            predicted_class = prediction["predicted_class"]
+            confidence = prediction["confidence"]
 
             # --- Advanced Options ---
             with st.expander("🔧 Advanced Options (customize language, plant name, and get your report by email!)", expanded=True):
@@ -353,41 +340,33 @@ with st.container():
 
             # --- Responsive Columns ---
             col1, col2, col3 = st.columns([1.2,1,1])
+            weather, observed_at = {}, None
             with col1:
                 if location and weather_api:
                     with st.spinner("Fetching weather data..."):
-                        data = get_weather(location)
+                        weather, observed_at, data = service.weather(location)
                         if "error" in data:
                             st.error(data["error"])
                         else:
-                            try:
-                                loc = data["location"]
-                                current = data["current"]
-                                condition = current["condition"]
-                                Temperature = current['temp_c']
-                                Condition = condition['text']
-                                Humidity = current['humidity']
-                                Wind = f"{current['wind_kph']} kph {current['wind_dir']}"
-                                UV_index = current['uv']
-                                st.markdown(f"""
-                                <div class="glass-card" style="background:var(--info-bg);">
-                                <div class="card-header">📍 Weather in {loc['name']}, {loc['country']}</div>
-                                <ul>
-                                    <li>🌡️ <b>Temperature:</b> {Temperature}°C (Feels like {current['feelslike_c']}°C)</li>
-                                    <li>🌤️ <b>Condition:</b> {Condition}</li>
-                                    <li>💧 <b>Humidity:</b> {Humidity}%</li>
-                                    <li>🌬️ <b>Wind:</b> {Wind}</li>
-                                    <li>☀️ <b>UV Index:</b> {UV_index}</li>
-                                </ul>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            except KeyError as e:
-                                st.error(f"Unexpected weather data format: {e}")
+                            loc = data["location"]
+                            current = data["current"]
+                            st.markdown(f"""
+                            <div class="glass-card" style="background:var(--info-bg);">
+                            <div class="card-header">📍 Weather in {loc['name']}, {loc['country']}</div>
+                            <ul>
+                                <li>🌡️ <b>Temperature:</b> {weather['Temperature']}°C (Feels like {current.get('feelslike_c')}°C)</li>
+                                <li>🌤️ <b>Condition:</b> {weather['Condition']}</li>
+                                <li>💧 <b>Humidity:</b> {weather['Humidity']}%</li>
+                                <li>🌬️ <b>Wind:</b> {weather['Wind']}</li>
+                                <li>☀️ <b>UV Index:</b> {weather['UV_index']}</li>
+                            </ul>
+                            </div>
+                            """, unsafe_allow_html=True)
                 else:
                     st.warning("⚠️ Please enter location and ensure weather API is configured.")
 
             with col2:
-                st.image(img, caption='Uploaded Image', use_container_width=True, output_format="PNG")
+                st.image(upload["thumbnail"], caption='Uploaded Image', use_container_width=True)
                 st.markdown('<div style="text-align:center; color:var(--accent); font-size:0.95rem;">Zoom for details</div>', unsafe_allow_html=True)
             with col3:
                 st.markdown(f"""
@@ -400,64 +379,142 @@ with st.container():
 
             st.markdown("---")
 
-            # --- Collapsible Results Section ---
-            with st.expander("📝 Recommended Actions", expanded=True):
-                st.markdown("### 📝 Recommended Actions")
-                try:
-                    crew = Crew(agents=[agriculture_agent], tasks=[diagnosis_task])
-                    result = crew.kickoff({
-                        'question': predicted_class,
-                        'predicted_class': predicted_class,
-                        'name': name,
-                        'language': language,
-                        'Temperature': Temperature,
-                        'Condition': Condition,
-                        'Humidity': Humidity,
-                        'Wind': Wind,
-                        'UV_index': UV_index
-                    })
-                    st.markdown(result, unsafe_allow_html=True)
-                    result_str = str(result)
-
-                    # --- Download PDF Button with icon ---
-                    pdf = create_pdf(result_str)
-                    if pdf:
-                        st.download_button(
-                            label="📄 Download PDF Report",
-                            data=pdf,
-                            file_name=f"{name}_plant_diagnosis.pdf",
-                            mime="application/pdf"
-                        )
-
-                    st.markdown("---")
-                    crew_recovery = Crew(agents=[recovery_agent], tasks=[recovery_task])
-                    recovery_result = crew_recovery.kickoff({
-                        'question': predicted_class,
-                        'predicted_class': predicted_class,
-                        'name': name,
-                        'language': language,
-                        'Temperature': Temperature,
-                        'Condition': Condition,
-                        'Humidity': Humidity,
-                        'Wind': Wind,
-                        'UV_index': UV_index})
-                    st.markdown("### 🌱 Recovery & Fertilizer Advice")
-                    st.markdown(recovery_result)
-
-                    # --- Toast notification for email ---
-                    if email:
-                        if send_email(email, "🌿 AgriGPT Plant Diagnosis Report", result_str):
-                            st.success("📧 Email sent successfully!")
-                        else:
-                            st.error("❌ Failed to send email. Please try again.")
-                except Exception as e:
-                    st.error(f"Error processing recommendation: {e}")
-
+            if prediction.get("low_confidence"):
+                st.warning(f"⚠️ The model is only {confidence:.0f}% sure about this image. "
+                           "A sharper close-up of the affected leaf will give a more reliable diagnosis.")
+
+            # Low-confidence predictions skip the crews when LOW_CONFIDENCE_ACTION=skip
+            if not should_run_crews(prediction):
+                st.info("Recommendations were skipped because the prediction is uncertain. Please upload a clearer photo.")
+            else:
+                # --- Collapsible Results Section ---
+                with st.expander("📝 Recommended Actions", expanded=True):
+                    st.markdown("### 📝 Recommended Actions")
+                    try:
+                        # Both crews run concurrently; a new upload or new inputs cancel the previous run.
+                        # Answers already stored for this photo and these inputs are shown without rerunning.
+                        inputs = crew_inputs(predicted_class, name, language, **weather)
+                        run_key = result_key(digest, inputs)
+                        run = st.session_state.get("crew_run")
+                        # A run answered in degraded form under load is retried on the next interaction
+                        if run is None or run.key != run_key or run.cancelled or (run.done() and run.shed):
+                            if run is not None:
+                                run.cancel()
+                            stored = result_store.get_results(run_key)
+                            if stored is not None:
+                                run = CrewRun.finished(stored, key=run_key)
+                            else:
+                                run = service.start_crews(predicted_class, name, language, weather, observed_at, key=run_key,
+                                                          acquire=True, timeout=DIAGNOSIS_QUEUE_TIMEOUT)
+                            st.session_state["crew_run"] = run
+
+                        diagnosis_box = st.empty()
+                        download_box = st.empty()
+                        st.markdown("---")
+                        st.markdown("### 🌱 Recovery & Fertilizer Advice")
+                        recovery_box = st.empty()
+                        boxes = {"diagnosis": diagnosis_box, "recovery": recovery_box}
+                        result_str = None
+                        report_future = None
+
+                        def show_download(report_future):
+                            report = report_future.result()
+                            # --- Download PDF Button with icon ---
+                            download_box.download_button(
+                                label="📄 Download PDF Report",
+                                data=report.pdf,
+                                file_name=f"{name}_plant_diagnosis.pdf",
+                                mime="application/pdf"
+                            )
+                            return report
+
+                        report = None
+                        for kind in ["diagnosis", "recovery", *run.updates()]:
+                            if kind in run.errors:
+                                raise run.errors[kind]
+                            if kind in run.results:
+                                boxes[kind].markdown(run.results[kind], unsafe_allow_html=True)
+                            elif run.partials[kind]:
+                                boxes[kind].info(run.partials[kind][-1])
+                            else:
+                                boxes[kind].info("⏳ Working on it...")
+
+                            # The PDF renders in another process while the recovery crew is still running
+                            if kind == "diagnosis" and kind in run.results and report_future is None:
+                                result_str = str(run.results["diagnosis"])
+                                report_future = resources.get("report_renderer").submit(result_str)
+                            if report is None and report_future is not None and report_future.done() and not report_future.exception():
+                                report = show_download(report_future)
+
+                        if report is None and report_future is not None:
+                            try:
+                                report = show_download(report_future)
+                            except Exception as e:
+                                st.error(f"Error creating PDF: {e}")
+
+                        if run.shed:
+                            st.info("⏳ AgriGPT is handling a lot of requests, so some advice above was taken from earlier "
+                                    "answers or the detected condition alone. Change any option or try again in a few "
+                                    "minutes for advice tailored to your weather.")
+                        elif run.degraded:
+                            st.info("ℹ️ Some advice above was taken from earlier answers or the detected condition alone, "
+                                    "because tailoring it to your weather needed more work than one diagnosis is allowed.")
+
+                        saved = st.session_state.setdefault("saved_results", set())
+                        if run.done() and not run.errors and not run.degraded and run_key not in saved:
+                            result_store.put_results(run_key, session_id, digest, model_signature(), inputs, run.results, location)
+                            saved.add(run_key)
+
+                        # --- Toast notification for email ---
+                        # The report is queued once per result and delivered in the background
+                        if email and result_str:
+                            outbox = resources.get("email_outbox")
+                            if not outbox.configured:
+                                st.error("Email credentials not configured")
+                            else:
+                                queued = st.session_state.setdefault("queued_emails", {})
+                                email_key = (email, hash(result_str))
+                                if email_key not in queued:
+                                    queued[email_key] = outbox.enqueue(email, "🌿 AgriGPT Plant Diagnosis Report", report.html if report else result_str)
+                                delivery = outbox.status(queued[email_key]) or {}
+                                if delivery.get("status") == "sent":
+                                    st.success("📧 Email sent successfully!")
+                                elif delivery.get("status") == "failed":
+                                    st.error(f"❌ Failed to send email: {delivery.get('last_error')}")
+                                else:
+                                    st.info("📧 Your report is on its way. It will arrive in a few moments.")
+                    except ServiceBusy as e:
+                        st.warning(f"⏳ {e}")
+                    except Exception as e:
+                        st.error(f"Error processing recommendation: {e}")
+
+        except ServiceBusy as e:
+            st.warning(f"⏳ {e}")
         except Exception as e:
             st.error(f"Error processing image: {e}")
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+# --- A past diagnosis picked in the sidebar, shown without recomputing anything ---
+if past_id is not None:
+    past = history[past_id]
+    with st.container():
+        st.markdown("### 🕘 Past Diagnosis")
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            if past["thumbnail"]:
+                st.image(past["thumbnail"], use_container_width=True)
+            if past["prediction"]:
+                st.markdown(f"**Class:** {past['prediction']['predicted_class']}  \n"
+                            f"**Confidence:** {past['prediction']['confidence']:.1f}%")
+            st.caption(f"{past['inputs'].get('name') or 'Plant'} · {past['location'] or 'no location'} · "
+                       f"{time.strftime('%d %b %Y %H:%M', time.localtime(past['created_at']))}")
+        with col2:
+            st.markdown(past["results"].get("diagnosis") or "", unsafe_allow_html=True)
+            if past["results"].get("recovery"):
+                st.markdown("#### 🌱 Recovery & Fertilizer Advice")
+                st.markdown(past["results"]["recovery"], unsafe_allow_html=True)
+
 # --- Animated Thank You Card ---
 st.markdown("""
 <div class="animated-thankyou" style="text-align:center;">
@@ -466,3 +523,27 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# --- Optional latency debug panel (AGRIGPT_DEBUG=1 or ?debug=1) ---
+if os.getenv("AGRIGPT_DEBUG") == "1" or st.query_params.get("debug") == "1":
+    with st.sidebar:
+        st.markdown("---")
+        with st.expander("⏱️ Stage latency", expanded=False):
+            stage_stats = trace_utils.stats()
+            if stage_stats:
+                st.dataframe(
+                    [{"stage": name, **{k: round(v, 1) for k, v in values.items()}} for name, values in stage_stats.items()],
+                    hide_index=True,
+                )
+            else:
+                st.caption("No spans recorded yet.")
+            for record in reversed(trace_utils.recent_spans(15)):
+                st.caption(f"{record['name']}: {record['duration_ms']:.1f} ms {record['attributes'] or ''}")
+        with st.expander("📦 Deferred imports", expanded=False):
+            # Heavy modules imported on first use rather than at startup
+            if lazy_utils.load_times:
+                st.dataframe(
+                    [{"module": name, "ms": round(seconds * 1000, 1)} for name, seconds in lazy_utils.load_times.items()],
+                    hide_index=True,
+                )
+            else:
+                st.caption("No deferred module loaded yet.")
@@ -0,0 +1,289 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.fakes import FakeEmbeddings, FakeLLMServer, FakeModel, FakeSMTPServer
+from utils import resource_utils as resources
+from utils.embedding_utils import CachedEmbeddings
+from utils.image_utils import load_image, to_array
+from utils.inference_utils import BatchClassifier, class_labels, load_pathogen_model, parse_views
+from utils.vector_store_utils import LocalVectorStore
+from utils.weather_utils import FakeWeatherProvider, WeatherClient, set_weather_provider
+
+STAGES = ("preprocess", "classify", "weather", "retrieve", "render", "email", "crews", "pipeline")
+LOCATIONS = ["Nairobi, Kenya", "Pune, India", "Kano, Nigeria", "Cusco, Peru", "Hanoi, Vietnam"]
+PLANTS = ["tomato", "maize", "cassava", "potato", "coffee", "banana", "rice", "beans"]
+REPORT_TEXT = "## Treatment\n\n" + "\n".join(f"- Step {i}: remove infected leaves and spray copper fungicide." for i in range(40))
+
+
+def make_images(count, size, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        gradient = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+        noise = rng.normal(0, 20, size=(size[1], size[0], 3))
+        pixels = np.clip(gradient + noise + rng.integers(0, 80, size=3), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def seed_corpus(store, documents, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = FakeEmbeddings()
+    texts, metadatas = [], []
+    for i in range(documents):
+        label, plant = class_labels[i % len(class_labels)], PLANTS[rng.integers(len(PLANTS))]
+        texts.append(f"{label} on {plant}: treatment note {i} with fungicide, pruning and irrigation advice")
+        metadatas.append({"query": label, "predicted_class": label, "name": plant})
+    for start in range(0, len(texts), 1000):
+        chunk = texts[start:start + 1000]
+        store.add_embeddings(chunk, embeddings.embed_documents(chunk), metadatas[start:start + 1000])
+
+
+def configure_offline(args, workdir, llm_server, smtp_server):
+    # Points every registry resource at an offline stand-in.
+    os.environ.update({
+        "OPENAI_API_KEY": "fake-key",
+        "OPENAI_API_BASE": llm_server.base_url,
+        "OPENAI_BASE_URL": llm_server.base_url,
+        "CREWAI_TELEMETRY_OPT_OUT": "true",
+        "OTEL_SDK_DISABLED": "true",
+    })
+    set_weather_provider(FakeWeatherProvider(latency=args.weather_latency))
+    if args.model == "fake":
+        resources.register("pathogen_model", lambda: FakeModel(latency=args.model_latency))
+    else:
+        resources.register("pathogen_model", lambda: load_pathogen_model(args.model_path, backend=args.model))
+    resources.register("embeddings", lambda: CachedEmbeddings(FakeEmbeddings(latency=args.embedding_latency)),
+                       teardown=lambda embeddings: embeddings.close())
+    resources.register("vectorstore", lambda: LocalVectorStore(os.path.join(workdir, "vector_store"), resources.get("embeddings")))
+    resources.register("response_store", lambda: LocalVectorStore(os.path.join(workdir, "response_cache"), resources.get("embeddings")))
+    if not args.cache:
+        resources.register("response_cache", lambda: None)
+
+    from utils.outbox_utils import EmailOutbox
+    resources.register("email_outbox", lambda: EmailOutbox(
+        os.path.join(workdir, "outbox.db"), sender="bench@agrigpt.local", password="",
+        host="127.0.0.1", port=smtp_server.port, use_ssl=False, retry_base=0.1,
+    ), teardown=lambda outbox: outbox.stop())
+
+
+def wait_for_email(outbox, message_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = outbox.status(message_id)
+        if status and status["status"] in ("sent", "failed"):
+            if status["status"] == "failed":
+                raise RuntimeError(status["last_error"])
+            return status
+        time.sleep(0.005)
+    raise TimeoutError("email was not delivered")
+
+
+def build_stages(args, images, arrays):
+    from utils.crew_utils import CrewRun, crew_inputs, kickoff
+
+    counter = iter(range(10 ** 12))
+    counter_lock = threading.Lock()
+
+    def next_index():
+        with counter_lock:
+            return next(counter)
+
+    def inputs_for(i):
+        weather = {"Temperature": 18 + i % 12, "Humidity": 40 + i % 50, "Condition": "Partly cloudy",
+                   "Wind": f"{i % 30} kph N", "UV_index": i % 11}
+        return crew_inputs(class_labels[i % len(class_labels)], PLANTS[i % len(PLANTS)], "en", **weather)
+
+    def preprocess(i):
+        return to_array(load_image(io.BytesIO(images[i % len(images)])))
+
+    classifier = None
+
+    def classify(i):
+        nonlocal classifier
+        if classifier is None:
+            classifier = BatchClassifier(resources.get("pathogen_model"), args.batch_size, views=parse_views(args.tta))
+        return classifier.classify(arrays[i % len(arrays)])
+
+    weather_client = WeatherClient(FakeWeatherProvider(latency=args.weather_latency), ttl=args.weather_ttl)
+
+    def weather(i):
+        return weather_client.get(LOCATIONS[i % len(LOCATIONS)])
+
+    def retrieve(i):
+        return resources.get("vectorstore").similarity_search(f"{class_labels[i % 5]} {PLANTS[i % len(PLANTS)]} treatment", k=3)
+
+    def render(i):
+        # Unique content, so the report cache never answers
+        return resources.get("report_renderer").render(f"{REPORT_TEXT}\n\nReport {next_index()}")
+
+    def email(i):
+        outbox = resources.get("email_outbox")
+        return wait_for_email(outbox, outbox.enqueue("farmer@example.com", "AgriGPT report", f"<p>report {i}</p>"))
+
+    def crews(i):
+        return kickoff("diagnosis", inputs_for(i))
+
+    def pipeline(i):
+        preprocess(i)
+        prediction = classify(i)
+        current = weather(i)["current"]
+        inputs = crew_inputs(prediction["predicted_class"], PLANTS[i % len(PLANTS)], "en",
+                             current["temp_c"], current["condition"]["text"], current["humidity"],
+                             f"{current['wind_kph']} kph {current['wind_dir']}", current["uv"])
+        run = CrewRun({"diagnosis": inputs, "recovery": inputs}, mode=args.crew_mode)
+        for _ in run.updates():
+            pass
+        if run.errors:
+            raise next(iter(run.errors.values()))
+        report = resources.get("report_renderer").render(f"{run.results['diagnosis']}\n\n{next_index()}")
+        outbox = resources.get("email_outbox")
+        return wait_for_email(outbox, outbox.enqueue("farmer@example.com", "AgriGPT report", report.html))
+
+    return {
+        "preprocess": preprocess, "classify": classify, "weather": weather, "retrieve": retrieve,
+        "render": render, "email": email, "crews": crews, "pipeline": pipeline,
+    }
+
+
+def run_stage(fn, concurrency, requests, warmup):
+    for i in range(warmup):
+        fn(i)
+    latencies, errors = [], []
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    values = np.asarray(latencies) if latencies else np.asarray([np.nan])
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else None,
+        "mean_ms": float(np.mean(values)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(np.max(values)),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["stage"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['environment'].get('commit')}):")
+    for r in results:
+        old = previous.get((r["stage"], r["concurrency"]))
+        if not old or not old["p50_ms"] or np.isnan(old["p50_ms"]):
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+        print(f"  {r['stage']:<11} c={r['concurrency']:<3} p50 {old['p50_ms']:>9.2f} -> {r['p50_ms']:>9.2f} ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the diagnosis pipeline against offline stand-ins.")
+    parser.add_argument("--stages", default=",".join(s for s in STAGES if s not in ("crews", "pipeline")),
+                        help=f"comma-separated subset of {','.join(STAGES)}; crews and pipeline need crewai installed")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=64, help="requests per stage and concurrency level")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--image-size", default="4000x3000", help="synthetic photo size, e.g. 4000x3000 (12 MP)")
+    parser.add_argument("--model", choices=["fake", "keras", "tflite", "onnx"], default="fake")
+    parser.add_argument("--model-path")
+    parser.add_argument("--model-latency", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--tta", default="", help="test-time augmentation views for the classify stage, e.g. all")
+    parser.add_argument("--documents", type=int, default=5000, help="documents seeded into the local vector store")
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--weather-latency", type=float, default=0.2)
+    parser.add_argument("--weather-ttl", type=float, default=600)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--smtp-latency", type=float, default=0.0)
+    parser.add_argument("--cache", action="store_true", help="keep the crew response cache enabled")
+    parser.add_argument("--crew-mode", choices=["crews", "combined"], default="crews",
+                        help="how the pipeline stage answers diagnosis and recovery (see CREW_MODE)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/pipeline-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to print p50 changes against")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="agrigpt-bench-")
+    results = []
+    with FakeLLMServer(latency=args.llm_latency) as llm_server, FakeSMTPServer(latency=args.smtp_latency) as smtp_server:
+        configure_offline(args, workdir, llm_server, smtp_server)
+        images = make_images(args.images, (width, height))
+        arrays = [to_array(load_image(io.BytesIO(image))) for image in images]
+        if "retrieve" in stages:
+            seed_corpus(resources.get("vectorstore"), args.documents)
+        stage_functions = build_stages(args, images, arrays)
+
+        for stage in stages:
+            for concurrency in levels:
+                llm_requests = llm_server.requests
+                result = {"stage": stage, **run_stage(stage_functions[stage], concurrency, args.requests, args.warmup)}
+                result["llm_calls_per_request"] = (llm_server.requests - llm_requests) / (args.requests + args.warmup)
+                results.append(result)
+                print(f"{stage:<11} c={concurrency:<3} {result['throughput_per_s'] or 0:>8.1f}/s  "
+                      f"p50 {result['p50_ms']:>9.2f}  p95 {result['p95_ms']:>9.2f}  p99 {result['p99_ms']:>9.2f} ms"
+                      + (f"  llm calls {result['llm_calls_per_request']:.1f}" if result["llm_calls_per_request"] else "")
+                      + (f"  errors {result['errors']} ({result['first_error']})" if result["errors"] else ""))
+        resources.invalidate()
+
+    output = args.output or os.path.join("benchmarks", "results", f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "arguments": vars(args), "results": results}, f, indent=2)
+    print(f"\nWrote {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_pipeline import environment
+from benchmarks.fakes import FakeEmbeddings
+from utils.inference_utils import class_labels
+from utils.retrieval_utils import Retriever
+from utils.vector_store_utils import LocalVectorStore, _matches
+
+CROPS = ["tomato", "maize", "cassava", "potato", "coffee", "banana", "rice", "beans", "wheat", "mango",
+         "pepper", "onion", "cabbage", "sorghum", "groundnut", "citrus", "grape", "cotton", "tea", "okra"]
+LANGUAGES = ["en", "en", "en", "sw", "hi"]
+ADVICE = [
+    "remove and burn infected leaves then spray copper fungicide every seven days",
+    "improve drainage and avoid overhead irrigation while humidity stays high",
+    "apply neem oil in the evening and release ladybirds against aphids",
+    "rotate crops for two seasons and disinfect pruning tools with bleach",
+    "side dress with balanced npk fertilizer and add compost to the root zone",
+    "use certified disease free seed and resistant varieties next season",
+    "mulch around the stem and water at the base early in the morning",
+    "scout weekly and rogue out plants showing mosaic or curling leaves",
+]
+MODES = ("unfiltered", "scan_filter", "prefilter", "hybrid", "hybrid_mmr")
+
+
+def build_corpus(path, documents, duplicates=0.2, seed=0):
+    # Stored responses with the metadata the response cache writes. A share of them
+    # are near-duplicates of another response, as repeated questions produce.
+    rng = np.random.default_rng(seed)
+    store = LocalVectorStore(path, FakeEmbeddings())
+    texts, metadatas, topics = [], [], []
+    for i in range(documents):
+        if texts and rng.random() < duplicates:
+            j = int(rng.integers(len(texts)))
+            texts.append(f"{texts[j]} (asked again {i})")
+            metadatas.append(dict(metadatas[j]))
+            topics.append(topics[j])
+            continue
+        label = class_labels[int(rng.integers(len(class_labels)))].lower()
+        crop = CROPS[int(rng.integers(len(CROPS)))]
+        language = LANGUAGES[int(rng.integers(len(LANGUAGES)))]
+        topic = int(rng.integers(len(ADVICE)))
+        texts.append(f"{label} on {crop}: {ADVICE[topic]}; {ADVICE[(topic + 1) % len(ADVICE)]}. note {i}")
+        metadatas.append({"query": f"{label} {crop} {language}", "predicted_class": label, "name": crop, "language": language})
+        topics.append(topic)
+    for start in range(0, documents, 2000):
+        chunk = texts[start:start + 2000]
+        store.add_embeddings(chunk, store.embedding.embed_documents(chunk), metadatas[start:start + 2000])
+    return store, topics
+
+
+def make_queries(count, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        label = class_labels[int(rng.integers(len(class_labels)))].lower()
+        crop = CROPS[int(rng.integers(len(CROPS)))]
+        queries.append((f"how to treat {label} on {crop} plants", {"predicted_class": label, "name": crop, "language": "en"}))
+    return queries
+
+
+def scan_filter_search(store, query, k, filter):
+    # What filtering cost before the metadata index: a Python scan over every record.
+    vector = store.embedding.embed_query(query)
+    mask = np.fromiter((_matches(r["metadata"], filter) for r in store._records), dtype=bool, count=len(store))
+    rows, _ = store.vector_search(vector, k, np.flatnonzero(mask))
+    return store.documents(rows)
+
+
+def run_mode(mode, store, queries, k, fetch_k):
+    retrievers = {
+        "prefilter": Retriever(store, k, fetch_k, mmr_lambda=1.0, keyword_weight=0.0),
+        "hybrid": Retriever(store, k, fetch_k, mmr_lambda=1.0),
+        "hybrid_mmr": Retriever(store, k, fetch_k),
+    }
+    latencies, precision, diversity = [], [], []
+    for query, filter in queries:
+        start = time.perf_counter()
+        if mode == "unfiltered":
+            docs = store.similarity_search(query, k=k)
+        elif mode == "scan_filter":
+            docs = scan_filter_search(store, query, k, filter)
+        else:
+            docs = retrievers[mode].search(query, k=k, filter=filter)
+        latencies.append((time.perf_counter() - start) * 1000)
+        relevant = [d.metadata.get("predicted_class") == filter["predicted_class"] and d.metadata.get("name") == filter["name"]
+                    for d in docs]
+        precision.append(sum(relevant) / k)
+        # Distinct advice among the results; near-duplicates count once.
+        diversity.append(len({d.page_content.split(" (asked again")[0] for d in docs}) / k)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "mode": mode,
+        "queries": len(queries),
+        "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+        "precision_at_k": float(np.mean(precision)),
+        "distinct_at_k": float(np.mean(diversity)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark knowledge-base retrieval over a synthetic corpus.")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of near-duplicate responses in the corpus")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--output", help="results file (default: benchmarks/results/retrieval-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="agrigpt-retrieval-") as workdir:
+        start = time.perf_counter()
+        store, _ = build_corpus(workdir, args.documents, args.duplicates)
+        build_s = time.perf_counter() - start
+        queries = make_queries(args.queries)
+        # First use builds the in-memory metadata and keyword indexes; timed on its own.
+        start = time.perf_counter()
+        store.filter_rows(queries[0][1])
+        store.keyword_search(queries[0][0], args.k)
+        index_s = time.perf_counter() - start
+        print(f"corpus of {len(store)} documents in {build_s:.1f}s, indexes built in {index_s:.2f}s")
+
+        results = []
+        for mode in modes:
+            result = run_mode(mode, store, queries, args.k, args.fetch_k)
+            results.append(result)
+            print(f"{mode:<12} p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms  "
+                  f"precision@{args.k} {result['precision_at_k']:.2f}  distinct@{args.k} {result['distinct_at_k']:.2f}")
+
+    output = args.output or os.path.join("benchmarks", "results", f"retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "arguments": vars(args), "corpus_build_s": build_s,
+                   "index_build_s": index_s, "results": results}, f, indent=2)
+    print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+FAKE_ANSWER = """Thought: I now know the final answer
+Final Answer: ## Treatment
+- Remove and destroy infected leaves.
+- Apply a copper-based fungicide early in the morning.
+- Avoid overhead irrigation while humidity stays high.
+
+## Recovery
+- Side-dress with a balanced NPK 10-10-10 fertilizer after two weeks.
+- Add compost to restore soil organic matter."""
+
+
+class FakeEmbeddings:
+    # Deterministic hashed bag-of-words vectors with the shape of all-MiniLM-L6-v2.
+    model_name = "fake-minilm"
+
+    def __init__(self, dim=384, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in str(text).lower().split():
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeModel:
+    # Stands in for the Keras classifier: a fixed random projection of the pixels.
+    def __init__(self, num_classes=5, latency=0.0, seed=0):
+        self.latency = latency
+        self._weights = np.random.default_rng(seed).normal(size=(3, num_classes)).astype(np.float32)
+
+    def predict(self, batch, verbose=0):
+        if self.latency:
+            time.sleep(self.latency)
+        logits = np.asarray(batch, dtype=np.float32).mean(axis=(1, 2)) @ self._weights
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+class _Server:
+    def __init__(self, server):
+        self.server = server
+        self.thread = threading.Thread(target=server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeLLMServer(_Server):
+    # OpenAI-compatible /v1/chat/completions endpoint. Point ChatOpenAI (and
+    # CrewAI, through litellm) at `base_url` with OPENAI_API_BASE/OPENAI_BASE_URL.
+    # With `max_concurrency` set, requests beyond it are answered 429 like a
+    # provider's rate limit.
+
+    def __init__(self, answer=FAKE_ANSWER, latency=0.5, port=0, max_concurrency=None):
+        self.answer = answer
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        lock = threading.Lock()
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with lock:
+                    outer.requests += 1
+                    if outer.max_concurrency is not None and outer.in_flight >= outer.max_concurrency:
+                        outer.rejected += 1
+                        rejected = True
+                    else:
+                        outer.in_flight += 1
+                        outer.peak_in_flight = max(outer.peak_in_flight, outer.in_flight)
+                        rejected = False
+                if rejected:
+                    self.reply(429, {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                               "code": "rate_limit_exceeded"}})
+                    return
+                try:
+                    self.complete(body)
+                finally:
+                    with lock:
+                        outer.in_flight -= 1
+
+            def complete(self, body):
+                if outer.latency:
+                    time.sleep(outer.latency)
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+                content = outer.answer
+                if (body.get("response_format") or {}).get("type") == "json_object":
+                    # Combined mode asks for both sections in one JSON object
+                    text = content.split("Final Answer:", 1)[-1].strip()
+                    content = json.dumps({"diagnosis": text, "recovery": text})
+                completion_tokens = len(content.split())
+                payload = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                }
+                self.reply(200, payload)
+
+            def reply(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        super().__init__(ThreadingHTTPServer(("127.0.0.1", port), Handler))
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+
+class FakeSMTPServer(_Server):
+    # Just enough SMTP for smtplib: EHLO/HELO, AUTH, MAIL, RCPT, DATA, NOOP, RSET, QUIT.
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.messages = []
+        self.connections = 0
+        outer = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + "\r\n").encode("ascii"))
+
+            def handle(self):
+                outer.connections += 1
+                self.reply("220 fake-smtp ready")
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    if verb == "EHLO":
+                        self.wfile.write(b"250-fake-smtp\r\n250 AUTH PLAIN LOGIN\r\n")
+                    elif verb == "HELO":
+                        self.reply("250 fake-smtp")
+                    elif verb == "AUTH":
+                        self.reply("235 Authentication successful")
+                    elif verb in ("MAIL", "NOOP"):
+                        self.reply("250 OK")
+                    elif verb == "RSET":
+                        recipients = []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipients.append(command.split(":", 1)[-1].strip(" <>"))
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if not chunk or chunk in (b".\r\n", b".\n"):
+                                break
+                            data.append(chunk)
+                        if outer.latency:
+                            time.sleep(outer.latency)
+                        outer.messages.append((recipients, b"".join(data)))
+                        recipients = []
+                        self.reply("250 OK: queued")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        super().__init__(server)
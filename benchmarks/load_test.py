@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.bench_pipeline import PLANTS, configure_offline, environment, seed_corpus
+from benchmarks.fakes import FakeLLMServer, FakeSMTPServer
+from utils import admission_utils
+from utils import resource_utils as resources
+from utils.inference_utils import class_labels
+
+LEVELS = {"interactive": admission_utils.INTERACTIVE, "api": admission_utils.API, "batch": admission_utils.BATCH}
+
+
+def sample_queues(controller, stop, samples, interval=0.05):
+    # Queue depth of the LLM pool per priority, sampled until `stop` is set.
+    while not stop.wait(interval):
+        queued = controller.metrics()["pools"]["llm"]["queued"]
+        for level, depth in queued.items():
+            samples[level].append(depth)
+
+
+def run_load(args):
+    from utils.crew_utils import CrewRun, crew_inputs
+
+    counter = iter(range(10 ** 12))
+    counter_lock = threading.Lock()
+    outcomes = defaultdict(lambda: defaultdict(int))
+    latencies = defaultdict(list)
+    results_lock = threading.Lock()
+
+    def session(level_name, requests):
+        with admission_utils.priority(LEVELS[level_name]):
+            for _ in range(requests):
+                with counter_lock:
+                    i = next(counter)
+                # Every request has its own weather, so neither the cache nor the index answers it
+                inputs = crew_inputs(class_labels[i % len(class_labels)], PLANTS[i % len(PLANTS)], "en",
+                                     Temperature=10 + i % 25, Condition="Partly cloudy", Humidity=30 + i % 60,
+                                     Wind=f"{i % 40} kph N", UV_index=i % 11)
+                start = time.perf_counter()
+                run = CrewRun({"diagnosis": inputs, "recovery": inputs}, mode=args.crew_mode)
+                for _ in run.updates():
+                    pass
+                elapsed = (time.perf_counter() - start) * 1000
+                outcome = "error" if run.errors else "degraded" if run.degraded else "ok"
+                with results_lock:
+                    outcomes[level_name][outcome] += 1
+                    latencies[level_name].append(elapsed)
+                    if run.errors and "first_error" not in outcomes[level_name]:
+                        error = next(iter(run.errors.values()))
+                        outcomes[level_name]["first_error"] = f"{type(error).__name__}: {error}"
+
+    controller = resources.get("admission_controller")
+    samples = defaultdict(list)
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_queues, args=(controller, stop, samples), daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=session, args=(level, args.requests), name=f"load-{level}-{n}")
+               for level, count in (("interactive", args.interactive), ("api", args.api), ("batch", args.batch))
+               for n in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+
+    levels = []
+    for level in LEVELS:
+        if not latencies[level]:
+            continue
+        p50, p95, p99 = np.percentile(latencies[level], [50, 95, 99])
+        depths = samples[level] or [0]
+        levels.append({
+            "priority": level,
+            "requests": len(latencies[level]),
+            "ok": outcomes[level]["ok"],
+            "degraded": outcomes[level]["degraded"],
+            "errors": outcomes[level]["error"],
+            "first_error": outcomes[level].get("first_error"),
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "max_queue_depth": int(max(depths)),
+            "mean_queue_depth": float(np.mean(depths)),
+        })
+    return {"elapsed_s": elapsed, "levels": levels, "admission": controller.metrics()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test admission control and degradation against a fake LLM provider.")
+    parser.add_argument("--interactive", type=int, default=24, help="concurrent Streamlit-like sessions")
+    parser.add_argument("--api", type=int, default=8, help="concurrent HTTP API clients")
+    parser.add_argument("--batch", type=int, default=8, help="concurrent batch-job workers")
+    parser.add_argument("--requests", type=int, default=4, help="diagnoses per session")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--provider-concurrency", type=int, default=6,
+                        help="requests the fake provider serves at once before answering 429")
+    parser.add_argument("--llm-concurrency", type=int, default=admission_utils.LLM_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=admission_utils.LLM_RATE_LIMIT, help="LLM requests per second")
+    parser.add_argument("--burst", type=int, default=admission_utils.LLM_RATE_BURST)
+    parser.add_argument("--max-queue", type=int, default=admission_utils.ADMISSION_MAX_QUEUE)
+    parser.add_argument("--timeout", type=float, default=admission_utils.ADMISSION_TIMEOUT)
+    parser.add_argument("--batch-timeout", type=float, default=admission_utils.ADMISSION_BATCH_TIMEOUT)
+    parser.add_argument("--no-admission", action="store_true",
+                        help="no concurrency or rate limits (429s are still answered in degraded form)")
+    parser.add_argument("--documents", type=int, default=2000, help="documents seeded for class-only answers")
+    parser.add_argument("--cache", action="store_true", help="keep the crew response cache enabled")
+    parser.add_argument("--crew-mode", choices=["crews", "combined"], default="crews")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/load-<timestamp>.json)")
+    args = parser.parse_args(argv)
+    # What configure_offline reads besides the options above
+    args.model, args.model_latency, args.embedding_latency, args.weather_latency = "fake", 0.0, 0.0, 0.0
+
+    workdir = tempfile.mkdtemp(prefix="agrigpt-load-")
+    with FakeLLMServer(latency=args.llm_latency, max_concurrency=args.provider_concurrency) as llm_server, \
+            FakeSMTPServer() as smtp_server:
+        configure_offline(args, workdir, llm_server, smtp_server)
+        if args.no_admission:
+            resources.register("admission_controller", lambda: admission_utils.AdmissionController(
+                llm_concurrency=10 ** 6, inference_concurrency=10 ** 6, rate=0, max_queue=10 ** 6))
+        else:
+            resources.register("admission_controller", lambda: admission_utils.AdmissionController(
+                llm_concurrency=args.llm_concurrency, rate=args.rate, burst=args.burst, max_queue=args.max_queue,
+                timeout=args.timeout, batch_timeout=args.batch_timeout))
+        seed_corpus(resources.get("vectorstore"), args.documents)
+        result = run_load(args)
+        result["provider"] = {"requests": llm_server.requests, "rejected_429": llm_server.rejected,
+                              "peak_in_flight": llm_server.peak_in_flight}
+        resources.invalidate()
+
+    print(f"{'admission off' if args.no_admission else 'admission on'}: {result['elapsed_s']:.1f}s, provider saw "
+          f"{result['provider']['requests']} requests, {result['provider']['rejected_429']} answered 429, "
+          f"peak {result['provider']['peak_in_flight']} in flight")
+    for level in result["levels"]:
+        print(f"{level['priority']:<12} n={level['requests']:<4} ok {level['ok']:<4} degraded {level['degraded']:<4} "
+              f"errors {level['errors']:<4} p50 {level['p50_ms']:>8.0f}  p95 {level['p95_ms']:>8.0f}  "
+              f"p99 {level['p99_ms']:>8.0f} ms  queue max {level['max_queue_depth']} mean {level['mean_queue_depth']:.1f}"
+              + (f"  ({level['first_error']})" if level["first_error"] else ""))
+
+    output = args.output or os.path.join("benchmarks", "results", f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "arguments": vars(args), **result}, f, indent=2, default=str)
+    print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def script_imports(script):
+    # Top-level import statements of a script, so the app itself is never executed.
+    with open(script, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=script)
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def measure(statements):
+    code = "\n".join(statements)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+    return rows, proc.returncode, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import time of a script's top-level imports.")
+    parser.add_argument("--script", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--module", action="append", default=[], help="time `import MODULE` instead of a script")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", dest="json_path", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    statements = [f"import {m}" for m in args.module] or script_imports(args.script)
+    rows, returncode, errors = measure(statements)
+    top_level = [r for r in rows if r["depth"] == 0]
+    total_ms = sum(r["cumulative_ms"] for r in top_level)
+
+    print(f"{len(statements)} import statements, {len(rows)} modules, {total_ms:.1f} ms total")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for r in sorted(top_level, key=lambda r: r["cumulative_ms"], reverse=True)[:args.top]:
+        print(f"{r['cumulative_ms']:>14.1f} {r['self_ms']:>9.1f}  {r['module']}")
+    if returncode:
+        print("\nImport failed:\n" + "\n".join(errors[-10:]), file=sys.stderr)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "statements": statements,
+                "total_ms": total_ms,
+                "returncode": returncode,
+                "modules": rows,
+            }, f, indent=2)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from utils import admission_utils
+from utils import profile_utils
+from utils import resource_utils as resources
+from utils.inference_utils import MAX_BATCH_SIZE, classify_paths, iter_images, should_run_crews
+from utils.trace_utils import span
+from utils.weather_utils import normalize_location
+
+# Groups whose crews may be in flight at once; the crews themselves share the CREW_WORKERS pool.
+BATCH_MAX_GROUPS = int(os.getenv("BATCH_MAX_GROUPS", "16"))
+
+RESULT_FIELDS = ("diagnosis", "recovery")
+
+
+def read_manifest(source, location=None, plant=None, language="en"):
+    # Yields one row per photo from a directory, a CSV file or a JSONL file.
+    # Manifest columns: image (or path), location, plant (or name), language and an optional id.
+    # The command-line values fill in whatever a row leaves out.
+    if os.path.isdir(source):
+        records = ({"image": path} for path in iter_images(source))
+        base = None
+    elif source.lower().endswith(".csv"):
+        records = _read_csv(source)
+        base = os.path.dirname(os.path.abspath(source))
+    else:
+        records = _read_jsonl(source)
+        base = os.path.dirname(os.path.abspath(source))
+    for record in records:
+        image = record.get("image") or record.get("path")
+        if not image:
+            continue
+        if base and not os.path.isabs(image):
+            image = os.path.join(base, image)
+        yield {
+            "id": str(record.get("id") or image),
+            "image": image,
+            "location": record.get("location") or location,
+            "plant": record.get("plant") or record.get("name") or plant or "",
+            "language": record.get("language") or language,
+        }
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def _read_jsonl(path):
+    # A line cut short by a crash is skipped rather than failing the whole file.
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def group_key(row):
+    return (row["predicted_class"], row["plant"].strip().lower(),
+            normalize_location(row["location"]) if row["location"] else "", row["language"])
+
+
+class BatchJob:
+    # Classifies every row, then runs the crews once per (class, plant, location, language).
+    # Predictions are checkpointed to `<output>.predictions.jsonl` and finished rows are
+    # appended to the output as soon as their group is answered, so a rerun with the
+    # same arguments picks up where a crashed one stopped.
+
+    def __init__(self, output, include_recovery=True, batch_size=MAX_BATCH_SIZE, max_groups=BATCH_MAX_GROUPS):
+        self.output = output
+        self.checkpoint = output + ".predictions.jsonl"
+        self.kinds = RESULT_FIELDS if include_recovery else RESULT_FIELDS[:1]
+        self.batch_size = batch_size
+        self.max_groups = max_groups
+        self.service = resources.get("diagnosis_service")
+        self._weather = {}
+
+    def run(self, rows, log=None):
+        # Queues behind interactive and API work for LLM and model capacity
+        with admission_utils.priority(admission_utils.BATCH):
+            return self._run(rows, log)
+
+    def _run(self, rows, log=None):
+        rows = list(rows)
+        # Rows are tracked by id across runs, so two rows with one id would silently become one
+        duplicates = sorted(row_id for row_id, count in Counter(row["id"] for row in rows).items() if count > 1)
+        if duplicates:
+            raise ValueError(f"{len(duplicates)} row ids appear more than once (e.g. {duplicates[0]!r}); "
+                             "give every row a unique id column")
+        done = self._finished_ids()
+        # Failed rows are classified (if that is what failed) and answered again
+        predicted = {record["id"]: record for record in _read_jsonl(self.checkpoint)
+                     if record["id"] not in done and "error" not in record}
+        rows = [row for row in rows if row["id"] not in done]
+        counts = {"skipped": len(done), "classified": 0, "groups": 0, "written": 0}
+
+        with open(self.checkpoint, "a", encoding="utf-8") as checkpoint:
+            todo = [row for row in rows if row["id"] not in predicted]
+            with span("batch.classify", rows=len(todo)):
+                results = classify_paths(resources.get("classifier"), (row["image"] for row in todo), self.batch_size)
+                for row, result in zip(todo, results):
+                    result.pop("image", None)
+                    predicted[row["id"]] = {**row, **result}
+                    _append(checkpoint, predicted[row["id"]])
+                    counts["classified"] += 1
+
+        groups = {}
+        with open(self.output, "a", encoding="utf-8") as out:
+            for row in rows:
+                record = predicted[row["id"]]
+                if "error" in record or not should_run_crews(record):
+                    _append(out, record)
+                    counts["written"] += 1
+                else:
+                    groups.setdefault(group_key(record), []).append(record)
+            counts["groups"] = len(groups)
+            if log:
+                log(f"{len(rows)} rows to finish, {len(groups)} unique (class, plant, location, language) groups")
+            counts["written"] += self._answer_groups(groups, out, log)
+        return counts
+
+    def _finished_ids(self):
+        # Ids of rows already answered. Rows that failed are dropped from the output,
+        # rewritten in place, so their retry does not leave a second line behind.
+        records = list(_read_jsonl(self.output))
+        finished = [record for record in records if "error" not in record]
+        if len(finished) != len(records):
+            with open(self.output + ".tmp", "w", encoding="utf-8") as f:
+                for record in finished:
+                    _append(f, record)
+            os.replace(self.output + ".tmp", self.output)
+        return {record["id"] for record in finished}
+
+    def _location_weather(self, location):
+        # One lookup per location for the whole job
+        key = normalize_location(location) if location else ""
+        if key not in self._weather:
+            weather, observed_at, data = self.service.weather(location)
+            self._weather[key] = (weather, observed_at, data.get("error") if data else None)
+        return self._weather[key]
+
+    def _start(self, records):
+        first = records[0]
+        weather, observed_at, _ = self._location_weather(first["location"])
+        return self.service.start_crews(first["predicted_class"], first["plant"], first["language"],
+                                        weather, observed_at, kinds=self.kinds)
+
+    def _finish(self, run, records, out):
+        weather, _, weather_error = self._location_weather(records[0]["location"])
+        error = next(iter(run.errors.values()), None)
+        for record in records:
+            record = {**record, "weather": weather or None, "weather_error": weather_error}
+            for kind in self.kinds:
+                record[kind] = run.results.get(kind)
+            if run.degraded:
+                record["degraded"] = dict(run.degraded)
+            if error is not None:
+                record["error"] = f"Recommendation failed: {error}"
+            _append(out, record)
+        return len(records)
+
+    def _answer_groups(self, groups, out, log=None):
+        pending = iter(groups.values())
+        in_flight = []
+        written = finished = 0
+        while True:
+            while len(in_flight) < self.max_groups:
+                records = next(pending, None)
+                if records is None:
+                    break
+                in_flight.append((self._start(records), records))
+            if not in_flight:
+                return written
+            still_running = []
+            for run, records in in_flight:
+                if run.done():
+                    written += self._finish(run, records, out)
+                    finished += 1
+                    if log:
+                        log(f"group {finished}/{len(groups)}: {records[0]['predicted_class']} / "
+                            f"{records[0]['plant'] or '-'} / {records[0]['location'] or '-'} ({len(records)} rows)")
+                else:
+                    still_running.append((run, records))
+            if len(still_running) == len(in_flight):
+                time.sleep(0.25)
+            in_flight = still_running
+
+
+def _append(f, record):
+    f.write(json.dumps(record, default=str) + "\n")
+    f.flush()
+
+
+def to_parquet(jsonl_path, parquet_path):
+    import duckdb
+    duckdb.read_json(jsonl_path, format="newline_delimited").write_parquet(parquet_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diagnose a folder or manifest of leaf photos offline.")
+    parser.add_argument("source", help="Image directory, or a .csv / .jsonl manifest with image, location and plant columns")
+    parser.add_argument("--output", required=True, help="JSONL results file (appended to; reruns resume from it)")
+    parser.add_argument("--parquet", help="Also write the finished results to this Parquet file")
+    parser.add_argument("--location", help="Location for rows that do not have one")
+    parser.add_argument("--plant", help="Plant name for rows that do not have one")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--no-recovery", action="store_true", help="Only run the diagnosis crew")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-groups", type=int, default=BATCH_MAX_GROUPS)
+    parser.add_argument("--profile", action="store_true", help="write memory and CPU profiles to PROFILE_DIR (see AGRIGPT_PROFILE)")
+    args = parser.parse_args(argv)
+    load_dotenv()
+    if args.profile or profile_utils.PROFILE:
+        profile_utils.enable()
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    rows = read_manifest(args.source, args.location, args.plant, args.language)
+    job = BatchJob(args.output, not args.no_recovery, args.batch_size, args.max_groups)
+    try:
+        counts = job.run(rows, log=log)
+    except ValueError as e:
+        parser.exit(2, f"error: {e}\n")
+    finally:
+        resources.invalidate()
+        profile_utils.disable()
+    log(f"done: {counts['written']} rows written, {counts['skipped']} already done, "
+        f"{counts['classified']} classified, {counts['groups']} crew groups")
+    if args.parquet:
+        to_parquet(args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import contextlib
+import os
+import threading
+
+from utils import admission_utils
+from utils import resource_utils as resources
+from utils.crew_utils import CrewRun, crew_inputs
+from utils.image_utils import ImageRejected, ingest_image
+from utils.inference_utils import should_run_crews
+from utils.trace_utils import span
+from utils.weather_utils import get_weather, weather_inputs
+
+# Diagnoses running at once, and how many more may wait for a slot before callers are turned away.
+DIAGNOSIS_CONCURRENCY = int(os.getenv("DIAGNOSIS_CONCURRENCY", "8"))
+DIAGNOSIS_QUEUE = int(os.getenv("DIAGNOSIS_QUEUE", "32"))
+# Seconds a queued request waits for a slot before it is turned away (503 over HTTP)
+DIAGNOSIS_QUEUE_TIMEOUT = float(os.getenv("DIAGNOSIS_QUEUE_TIMEOUT", "30"))
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+class DiagnosisService:
+    # The diagnosis pipeline without any UI: classify, look up the weather,
+    # run both crews. Model, vectorstore and crews come from the shared
+    # resource registry, so every caller in the process uses the same ones.
+
+    def __init__(self, max_concurrency=DIAGNOSIS_CONCURRENCY, max_queue=DIAGNOSIS_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._slots = threading.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "waiting": self._waiting,
+                    "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+
+    def _acquire(self, timeout):
+        # A free slot is taken at once; only callers that have to wait count against max_queue
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self._active += 1
+            return
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise ServiceBusy("Too many diagnoses in progress, please retry shortly")
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise ServiceBusy("Timed out waiting for a free diagnosis slot")
+        with self._lock:
+            self._active += 1
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def slot(self, timeout=None):
+        # One of the max_concurrency diagnosis slots, for callers that run the steps themselves
+        self._acquire(timeout)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def classify_array(self, img_array):
+        # Classification waits for a slot in the process-wide inference pool; a full pool raises ServiceBusy.
+        classifier = resources.get("classifier")
+        try:
+            with admission_utils.get_controller().admit("inference"):
+                return classifier.classify(img_array)
+        except admission_utils.Overloaded as e:
+            raise ServiceBusy(f"The classifier is busy, please retry shortly ({e})")
+
+    def classify_image(self, image_bytes):
+        if not image_bytes:
+            raise InvalidRequest("No image was uploaded")
+        try:
+            image = ingest_image(image_bytes, thumbnail_size=None)
+        except ImageRejected as e:
+            raise InvalidRequest(str(e))
+        return self.classify_array(image.array)
+
+    def weather(self, location):
+        # Returns (prompt weather fields, observation time, raw data or error dict)
+        if not location:
+            return {}, None, None
+        data = get_weather(location)
+        if "error" in data:
+            return {}, None, data
+        try:
+            return weather_inputs(data), data["current"].get("last_updated_epoch"), data
+        except KeyError as e:
+            return {}, None, {"error": f"Unexpected weather data format: {e}"}
+
+    def start_crews(self, predicted_class, name, language, weather, observed_at=None, kinds=("diagnosis", "recovery"), key=None,
+                    acquire=False, timeout=None):
+        # With `acquire`, the run takes a diagnosis slot of its own and gives it back once every crew
+        # has finished; callers already holding one (diagnose) leave it off.
+        inputs = crew_inputs(predicted_class, name, language, **weather)
+        if not acquire:
+            return CrewRun({kind: inputs for kind in kinds}, observed_at=observed_at, key=key)
+        self._acquire(timeout)
+        try:
+            run = CrewRun({kind: inputs for kind in kinds}, observed_at=observed_at, key=key)
+        except BaseException:
+            self._release()
+            raise
+        run.add_done_callback(lambda _: self._release())
+        return run
+
+    def diagnose(self, image_bytes, location=None, language="en", name="", include_recovery=True, timeout=None,
+                 priority=admission_utils.API):
+        with self.slot(timeout):
+            with admission_utils.priority(priority), span("diagnosis.request", language=language, has_location=bool(location)):
+                prediction = self.classify_image(image_bytes)
+                weather, observed_at, weather_data = self.weather(location)
+                result = {
+                    **prediction,
+                    "weather": weather or None,
+                    "weather_error": weather_data.get("error") if weather_data else None,
+                    "recommendations": None,
+                }
+                if not should_run_crews(prediction):
+                    return result
+                kinds = ("diagnosis", "recovery") if include_recovery else ("diagnosis",)
+                run = self.start_crews(prediction["predicted_class"], name, language, weather, observed_at, kinds)
+                for _ in run.updates():
+                    pass
+                if run.errors:
+                    raise next(iter(run.errors.values()))
+                result["recommendations"] = {kind: run.results.get(kind) for kind in kinds}
+                # Crews shed under load answered from cache or the class alone
+                result["degraded"] = dict(run.degraded) or None
+                return result
+
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from services.diagnosis_service import (DIAGNOSIS_CONCURRENCY, DIAGNOSIS_QUEUE, DIAGNOSIS_QUEUE_TIMEOUT, InvalidRequest,
+                                        ServiceBusy)
+from utils import profile_utils
+from utils import resource_utils as resources
+from utils import trace_utils
+from utils.weather_utils import weather_available
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+
+# One thread per diagnosis slot plus the waiting room. Requests beyond that are
+# answered with 503 before they reach the pool, so none waits in its unbounded
+# queue where DIAGNOSIS_QUEUE_TIMEOUT has not started counting.
+_executor = ThreadPoolExecutor(max_workers=DIAGNOSIS_CONCURRENCY + DIAGNOSIS_QUEUE, thread_name_prefix="api")
+# Diagnoses handed to the pool and not yet answered; only touched on the event loop
+_in_flight = 0
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", "model_loaded": resources.is_loaded("pathogen_model")})
+
+
+async def stats(request):
+    body = {"service": resources.get("diagnosis_service").stats(), "stages": trace_utils.stats(),
+            "admission": resources.get("admission_controller").metrics()}
+    if resources.is_loaded("weather_prefetcher"):
+        body["weather_prefetch"] = resources.get("weather_prefetcher").snapshot()["stats"]
+    return JSONResponse(body)
+
+
+async def metrics(request):
+    # Queue depths, pool usage and rate-limit state in the Prometheus text format
+    return PlainTextResponse(resources.get("admission_controller").prometheus(),
+                             media_type="text/plain; version=0.0.4")
+
+
+async def _read_request(request):
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = json.loads(await request.body() or b"{}")
+            return base64.b64decode(body.get("image") or ""), body
+        except (ValueError, TypeError) as e:
+            raise InvalidRequest(f"Invalid JSON body: {e}")
+    form = await request.form()
+    upload = form.get("image")
+    image = await upload.read() if hasattr(upload, "read") else b""
+    return image, {key: form.get(key) for key in ("location", "language", "name", "include_recovery")}
+
+
+async def diagnose(request):
+    # POST /v1/diagnose, either multipart/form-data with an `image` file or JSON
+    # with a base64 `image`. Other fields: location, language, name, include_recovery.
+    global _in_flight
+    if _in_flight >= DIAGNOSIS_CONCURRENCY + DIAGNOSIS_QUEUE:
+        return JSONResponse({"error": "Too many diagnoses in progress, please retry shortly"},
+                            status_code=503, headers={"Retry-After": "5"})
+    _in_flight += 1
+    try:
+        image, fields = await _read_request(request)
+        include_recovery = str(fields.get("include_recovery", "true")).lower() not in ("0", "false", "no")
+        service = resources.get("diagnosis_service")
+        result = await asyncio.get_running_loop().run_in_executor(
+            _executor, lambda: service.diagnose(
+                image,
+                location=fields.get("location"),
+                language=fields.get("language") or "en",
+                name=fields.get("name") or "",
+                include_recovery=include_recovery,
+                timeout=DIAGNOSIS_QUEUE_TIMEOUT,
+            ),
+        )
+    except InvalidRequest as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except ServiceBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        return JSONResponse({"error": f"Error processing recommendation: {e}"}, status_code=500)
+    finally:
+        _in_flight -= 1
+        # Allocation snapshot between requests when profiling (at most one per PROFILE_SNAPSHOT_INTERVAL)
+        profile_utils.checkpoint("request")
+    return JSONResponse(result)
+
+
+def make_app(warm_up=True):
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        if warm_up:
+            resources.warm_up_async("classifier", "knowledge_tool", "diagnosis_task", "recovery_task")
+        if weather_available():
+            # Does nothing unless WEATHER_PREFETCH_INTERVAL is set
+            resources.get("weather_prefetcher").start()
+        yield
+
+    return Starlette(
+        routes=[
+            Route("/healthz", health),
+            Route("/v1/stats", stats),
+            Route("/metrics", metrics),
+            Route("/v1/diagnose", diagnose, methods=["POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the AgriGPT diagnosis pipeline over HTTP.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--no-warm-up", action="store_true", help="load the model and crews on the first request instead")
+    parser.add_argument("--profile", action="store_true", help="write memory and CPU profiles to PROFILE_DIR (see AGRIGPT_PROFILE)")
+    args = parser.parse_args(argv)
+    load_dotenv()
+    if args.profile or os.getenv("AGRIGPT_PROFILE") == "1":
+        profile_utils.enable()
+
+    import uvicorn
+    uvicorn.run(make_app(warm_up=not args.no_warm_up), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
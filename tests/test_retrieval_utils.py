@@ -0,0 +1,34 @@
+from benchmarks.fakes import FakeEmbeddings
+from utils.retrieval_utils import FILTER_PROBES, Retriever
+from utils.vector_store_utils import LocalVectorStore
+
+
+class RemoteStore:
+    # Stand-in for a remote vectorstore whose documents only carry some metadata values.
+    def __init__(self, matching):
+        self.matching = matching
+        self.filters = []
+
+    def similarity_search(self, query, k=4, filter=None):
+        self.filters.append(filter)
+        if filter and filter.get("name") not in self.matching:
+            return []
+        from langchain.docstore.document import Document
+        return [Document(page_content=f"{query} {filter}")]
+
+
+def test_empty_local_store_returns_nothing(tmp_path):
+    retriever = Retriever(LocalVectorStore(str(tmp_path), FakeEmbeddings()), mmr_lambda=1)
+    assert retriever.search("leaf spots", filter={"predicted_class": "Tomato___Early_blight"}) == []
+    assert retriever.search("leaf spots") == []
+
+
+def test_missing_filter_value_does_not_suppress_other_values():
+    store = RemoteStore(matching={"tomato"})
+    retriever = Retriever(store, k=1, mmr_lambda=1)
+    for _ in range(FILTER_PROBES + 1):
+        retriever.search("leaf spots", filter={"name": "cassava"})
+    assert {"name": "cassava"} not in store.filters[-2:]
+    store.filters.clear()
+    assert retriever.search("leaf spots", filter={"name": "tomato"})
+    assert store.filters == [{"name": "tomato"}]
@@ -0,0 +1,34 @@
+from crewai.tools import BaseTool
+
+from utils.astra_db_utils import format_documents, get_astra_vectorstore, store_response, similarity_search
+from utils.policy_utils import dedup_tool_call
+from utils.retrieval_utils import Retriever, current_filters
+from utils.trace_utils import span
+
+
+class AstraSearchTool(BaseTool):
+    name: str = "Astra Search Tool"
+    description: str = "Retrieves plant disease treatments from Astra DB based on similarity."
+    _vectorstore = None
+    _retriever = None
+
+    def __init__(self, vectorstore=None, **kwargs):
+        super().__init__(**kwargs)
+        self._vectorstore = vectorstore if vectorstore is not None else get_astra_vectorstore()
+        if self._vectorstore is not None:
+            self._retriever = Retriever(self._vectorstore)
+
+    def _run(self, query: str) -> str:
+        # Agents often repeat the same query; within one run it is searched once.
+        return dedup_tool_call(self.name, query, lambda: self.search(query))
+
+    def search(self, query: str) -> str:
+        # Prefiltered by the class, crop and language of the crew that is asking.
+        filters = current_filters()
+        with span("knowledge.search", filtered=bool(filters)):
+            if self._retriever is None:
+                return similarity_search(self._vectorstore, query)
+            return format_documents(self._retriever.search(query, filter=filters))
+
+    def store_response(self, query: str, response):
+        store_response(self._vectorstore, query, response, current_filters())
@@ -0,0 +1,234 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from utils.rate_limit_utils import TokenBucket
+from utils.trace_utils import span
+
+# Priorities, most urgent first. Streamlit sessions are interactive, the HTTP API
+# is served next, and the offline batch job takes whatever capacity is left.
+INTERACTIVE, API, BATCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", API: "api", BATCH: "batch"}
+
+# LLM requests in flight at once across every session, crew and job in the process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+# Images waiting on or inside the classifier at once
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "64"))
+# Requests per second and burst per LLM provider; LLM_RATE_LIMIT_<PROVIDER> (e.g. _GROQ) overrides
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "5"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+# Waiters per pool before new work is turned away without queueing
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Seconds a request waits for a slot and a rate-limit token before it is shed
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "15"))
+ADMISSION_BATCH_TIMEOUT = float(os.getenv("ADMISSION_BATCH_TIMEOUT", "300"))
+
+_priority = contextvars.ContextVar("admission_priority", default=INTERACTIVE)
+
+
+class Overloaded(Exception):
+    pass
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def priority(level):
+    # Work started inside, including crews submitted from here, queues at `level`.
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
+
+
+def provider_of(model):
+    # litellm model names carry the provider as a prefix ("groq/llama3-70b"); bare names are OpenAI's.
+    model = str(model or "")
+    return model.split("/", 1)[0].lower() if "/" in model else "openai"
+
+
+def is_rate_limit_error(error):
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+
+class PriorityPool:
+    # A counting semaphore whose waiters are let in most urgent first, and in
+    # arrival order within a priority. Beyond `max_queue` waiters new work is
+    # refused straight away instead of piling up.
+
+    def __init__(self, name, limit, max_queue=ADMISSION_MAX_QUEUE):
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.max_queue = max_queue
+        self.stats = {"admitted": 0, "shed": 0, "timeouts": 0, "wait_ms": 0.0}
+        self._active = 0
+        self._waiters = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def check(self):
+        # Fails fast when the queue is already full, before any work is started.
+        with self._lock:
+            if len(self._waiters) >= self.max_queue:
+                self.stats["shed"] += 1
+                raise Overloaded(f"The {self.name} pool is saturated")
+
+    def acquire(self, priority, timeout=None):
+        start = time.monotonic()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self.stats["admitted"] += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.stats["shed"] += 1
+                raise Overloaded(f"Too many requests waiting for the {self.name} pool")
+            waiter = (priority, next(self._order), threading.Event())
+            heapq.heappush(self._waiters, waiter)
+        granted = waiter[2].wait(timeout)
+        with self._lock:
+            # A release may hand over the slot just after the wait timed out.
+            if not granted and not waiter[2].is_set():
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self.stats["timeouts"] += 1
+                raise Overloaded(f"Timed out after {timeout:.0f}s waiting for the {self.name} pool")
+            self.stats["admitted"] += 1
+            self.stats["wait_ms"] += (time.monotonic() - start) * 1000
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # The slot passes straight to the most urgent waiter.
+                heapq.heappop(self._waiters)[2].set()
+            else:
+                self._active -= 1
+
+    def snapshot(self):
+        with self._lock:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for level, _, _ in self._waiters:
+                name = PRIORITY_NAMES.get(level, str(level))
+                queued[name] = queued.get(name, 0) + 1
+            return {"limit": self.limit, "active": self._active, "queued": queued, **self.stats}
+
+
+class AdmissionController:
+    # Process-wide limits around the expensive calls: a priority pool each for
+    # LLM requests and classification, plus a token bucket per LLM provider.
+    # Anything refused raises Overloaded, which callers turn into a degraded
+    # answer (see crew_utils.degraded_answer) or a 503.
+
+    def __init__(self, llm_concurrency=LLM_CONCURRENCY, inference_concurrency=INFERENCE_CONCURRENCY,
+                 rate=LLM_RATE_LIMIT, burst=LLM_RATE_BURST, max_queue=ADMISSION_MAX_QUEUE,
+                 timeout=ADMISSION_TIMEOUT, batch_timeout=ADMISSION_BATCH_TIMEOUT):
+        self.pools = {
+            "llm": PriorityPool("llm", llm_concurrency, max_queue),
+            "inference": PriorityPool("inference", inference_concurrency, max_queue),
+        }
+        self.rate = rate
+        self.burst = burst
+        self.timeouts = {INTERACTIVE: timeout, API: timeout, BATCH: batch_timeout}
+        self.stats = {"degraded": 0}
+        self._limiters = {}
+        self._throttled = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, provider):
+        with self._lock:
+            limiter = self._limiters.get(provider)
+            if limiter is None:
+                rate = float(os.getenv(f"LLM_RATE_LIMIT_{provider.upper()}", self.rate))
+                limiter = self._limiters[provider] = TokenBucket(rate, self.burst)
+            return limiter
+
+    def check(self, pool):
+        self.pools[pool].check()
+
+    @contextlib.contextmanager
+    def admit(self, pool, level=None, timeout=None):
+        level = current_priority() if level is None else level
+        timeout = self.timeouts.get(level, ADMISSION_TIMEOUT) if timeout is None else timeout
+        with span("admission.wait", pool=pool, priority=PRIORITY_NAMES.get(level, level)):
+            self.pools[pool].acquire(level, timeout)
+        try:
+            yield
+        finally:
+            self.pools[pool].release()
+
+    @contextlib.contextmanager
+    def llm_call(self, provider, level=None):
+        level = current_priority() if level is None else level
+        timeout = self.timeouts.get(level, ADMISSION_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        with self.admit("llm", level, timeout):
+            if not self.limiter(provider).acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise Overloaded(f"The {provider} rate limit is used up")
+            yield
+
+    def throttled(self, provider):
+        # The provider answered 429: stop spending tokens until the bucket refills.
+        self.limiter(provider).drain()
+        with self._lock:
+            self._throttled[provider] = self._throttled.get(provider, 0) + 1
+
+    def degraded(self):
+        with self._lock:
+            self.stats["degraded"] += 1
+
+    def metrics(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+            throttled = dict(self._throttled)
+            stats = dict(self.stats)
+        return {
+            "pools": {name: pool.snapshot() for name, pool in self.pools.items()},
+            "providers": {name: {"rate": limiter.rate, "tokens": None if limiter.unlimited else limiter.available(),
+                                 "throttled": throttled.get(name, 0)} for name, limiter in limiters.items()},
+            **stats,
+        }
+
+    def prometheus(self):
+        # The same numbers in the Prometheus text format, for /metrics.
+        metrics = self.metrics()
+        lines = []
+
+        def emit(name, kind, help_text, samples):
+            lines.append(f"# HELP agrigpt_{name} {help_text}")
+            lines.append(f"# TYPE agrigpt_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"agrigpt_{name}{{{label_text}}} {value}" if label_text else f"agrigpt_{name} {value}")
+
+        pools = metrics["pools"]
+        emit("admission_queue_depth", "gauge", "Requests waiting for a slot",
+             [({"pool": name, "priority": level}, count)
+              for name, pool in pools.items() for level, count in pool["queued"].items()])
+        emit("admission_active", "gauge", "Slots in use", [({"pool": name}, pool["active"]) for name, pool in pools.items()])
+        emit("admission_limit", "gauge", "Slots per pool", [({"pool": name}, pool["limit"]) for name, pool in pools.items()])
+        for stat, help_text in (("admitted", "Requests let in"), ("shed", "Requests refused because the queue was full"),
+                                ("timeouts", "Requests that gave up waiting")):
+            emit(f"admission_{stat}_total", "counter", help_text,
+                 [({"pool": name}, pool[stat]) for name, pool in pools.items()])
+        emit("admission_wait_seconds_total", "counter", "Time spent waiting for a slot",
+             [({"pool": name}, pool["wait_ms"] / 1000) for name, pool in pools.items()])
+        emit("llm_rate_tokens", "gauge", "Rate-limit tokens left per provider",
+             [({"provider": name}, provider["tokens"]) for name, provider in metrics["providers"].items()
+              if provider["tokens"] is not None])
+        emit("llm_throttled_total", "counter", "429 answers per provider",
+             [({"provider": name}, provider["throttled"]) for name, provider in metrics["providers"].items()])
+        emit("degraded_answers_total", "counter", "Answers served from cache or the class alone under load",
+             [({}, metrics["degraded"])])
+        return "\n".join(lines) + "\n"
+
+
+def get_controller():
+    from utils import resource_utils as resources
+    return resources.get("admission_controller")
@@ -0,0 +1,254 @@
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.cache_utils import normalize_text
+from utils.inference_utils import class_labels
+
+ADVICE_INDEX_PATH = os.getenv("ADVICE_INDEX_PATH", "advice_index.json.gz")
+
+CROPS = (
+    "tomato", "potato", "pepper", "eggplant", "cucumber", "squash", "pumpkin", "watermelon",
+    "bean", "pea", "soybean", "groundnut", "maize", "rice", "wheat", "sorghum", "millet",
+    "cassava", "sweet potato", "banana", "plantain", "mango", "citrus", "orange", "apple",
+    "grape", "strawberry", "coffee", "tea", "cocoa", "cotton", "sugarcane", "cabbage",
+    "kale", "onion", "garlic", "carrot", "lettuce", "spinach", "okra",
+)
+
+# Weather is indexed far more coarsely than the response cache buckets it: advice for a
+# warm, humid, rainy day is the same whatever the exact wind speed or UV index.
+TEMPERATURE_BANDS = (("cold", 10), ("mild", 20), ("warm", 30), ("hot", None))
+HUMIDITY_BANDS = (("dry", 40), ("moderate", 70), ("humid", None))
+CONDITION_BANDS = {
+    "storm": ("thunder", "storm", "blizzard"),
+    "snow": ("snow", "sleet", "ice"),
+    "rain": ("rain", "drizzle", "shower"),
+    "fog": ("fog", "mist", "haze"),
+    "cloudy": ("cloud", "overcast"),
+    "clear": ("sun", "clear"),
+}
+# Values the crews are prompted with when filling each band
+TEMPERATURE_MIDPOINTS = {"cold": 5, "mild": 15, "warm": 25, "hot": 35}
+HUMIDITY_MIDPOINTS = {"dry": 30, "moderate": 55, "humid": 85}
+CONDITION_TEXT = {"storm": "Thunderstorm", "snow": "Light snow", "rain": "Moderate rain",
+                  "fog": "Mist", "cloudy": "Partly cloudy", "clear": "Sunny"}
+
+# Files whose prompts the index answers for; editing any of them makes an index stale.
+PROMPT_SOURCES = ("agents/agriculture_agent.py", "agents/recovery_agent.py",
+                  "tasks/diagnosis_task.py", "tasks/recovery_task.py")
+BUCKET_SCHEME = 1
+
+
+def _numeric_band(value, bands):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    for name, upper in bands:
+        if upper is None or value < upper:
+            return name
+
+
+def condition_band(condition):
+    text = str(condition or "").lower()
+    for name, words in CONDITION_BANDS.items():
+        if any(word in text for word in words):
+            return name
+    return None
+
+
+def advice_bucket(Temperature=None, Humidity=None, Condition=None, **_):
+    bucket = (_numeric_band(Temperature, TEMPERATURE_BANDS), _numeric_band(Humidity, HUMIDITY_BANDS),
+              condition_band(Condition))
+    return None if None in bucket else bucket
+
+
+def crop_name(name):
+    # Maps "Tomatoes" or "tomato plant" onto the crop list; anything else is not indexed.
+    name = normalize_text(name)
+    for candidate in (name, name.removesuffix(" plant"), name.removesuffix("es"), name.removesuffix("s")):
+        if candidate in CROPS:
+            return candidate
+    return None
+
+
+def _advice_parts(kind, inputs):
+    crop = crop_name(inputs.get("name"))
+    if crop is None or not inputs.get("predicted_class"):
+        return None
+    return [kind, normalize_text(inputs["predicted_class"]), crop, normalize_text(inputs.get("language") or "en")]
+
+
+def advice_key(kind, inputs):
+    parts = _advice_parts(kind, inputs)
+    if parts is None:
+        return None
+    if kind == "diagnosis":
+        bucket = advice_bucket(**inputs)
+        if bucket is None:
+            return None
+        parts.extend(bucket)
+    return "|".join(parts)
+
+
+def prompt_version(root=None):
+    root = root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256(f"{BUCKET_SCHEME}|{os.getenv('LLM_MODEL', 'gpt-4.1-mini')}".encode("utf-8"))
+    for path in PROMPT_SOURCES:
+        with open(os.path.join(root, path), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class AdviceIndex:
+    # Precomputed crew answers, held in one dict. An index built from other prompts
+    # than the current ones loads as empty, so stale advice is never served.
+
+    def __init__(self, entries=None, version=None, created_at=None):
+        self.entries = entries or {}
+        self.version = version or prompt_version()
+        self.created_at = created_at
+        self.stats = {"hit": 0, "miss": 0}
+        self._any_weather = None
+
+    @classmethod
+    def load(cls, path=ADVICE_INDEX_PATH):
+        version = prompt_version()
+        if not os.path.exists(path):
+            return cls(version=version)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != version:
+            return cls(version=version)
+        return cls(data["entries"], version, data.get("created_at"))
+
+    def save(self, path=ADVICE_INDEX_PATH):
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"version": self.version, "created_at": time.time(), "entries": self.entries}, f)
+        os.replace(tmp, path)
+
+    def get(self, kind, inputs):
+        key = advice_key(kind, inputs)
+        response = self.entries.get(key) if key else None
+        self.stats["hit" if response is not None else "miss"] += 1
+        return response
+
+    def nearest(self, kind, inputs):
+        # Advice for the same class, crop and language under any weather band; only
+        # for when a live answer cannot be had, e.g. while the LLM is saturated.
+        parts = _advice_parts(kind, inputs)
+        if parts is None:
+            return None
+        if self._any_weather is None:
+            any_weather = {}
+            for key, response in self.entries.items():
+                any_weather.setdefault("|".join(key.split("|")[:4]), response)
+            self._any_weather = any_weather
+        return self._any_weather.get("|".join(parts))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def index_inputs(classes, crops, languages):
+    # Yields (kind, inputs) for every combination the index holds.
+    from utils.crew_utils import crew_inputs
+    for predicted_class, crop, language in itertools.product(classes, crops, languages):
+        yield "recovery", crew_inputs(predicted_class, crop, language)
+        for temperature, humidity, condition in itertools.product(TEMPERATURE_MIDPOINTS, HUMIDITY_MIDPOINTS, CONDITION_TEXT):
+            yield "diagnosis", crew_inputs(
+                predicted_class, crop, language,
+                Temperature=TEMPERATURE_MIDPOINTS[temperature], Condition=CONDITION_TEXT[condition],
+                Humidity=HUMIDITY_MIDPOINTS[humidity], Wind="n/a", UV_index="n/a",
+            )
+
+
+def build_index(path=ADVICE_INDEX_PATH, classes=class_labels, crops=CROPS, languages=("en",),
+                workers=8, save_every=50, log=None):
+    # Fills in whatever the index at `path` is missing, saving as it goes so an
+    # interrupted build resumes where it stopped.
+    from utils import policy_utils
+    from utils.crew_utils import kickoff
+
+    index = AdviceIndex.load(path)
+    todo = [(kind, inputs) for kind, inputs in index_inputs(classes, crops, languages)
+            if advice_key(kind, inputs) not in index.entries]
+    if log:
+        log(f"index {index.version}: {len(index)} entries, {len(todo)} to generate")
+
+    def generate(kind, inputs):
+        with policy_utils.activate(policy_utils.RunScope()):
+            return kickoff(kind, inputs, use_index=False)
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="advice-index") as pool:
+        futures = {pool.submit(generate, kind, inputs): (kind, inputs) for kind, inputs in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            kind, inputs = futures[future]
+            try:
+                index.entries[advice_key(kind, inputs)] = future.result()
+            except Exception as e:
+                failures += 1
+                if log:
+                    log(f"failed {advice_key(kind, inputs)}: {e}")
+            if done % save_every == 0:
+                index.save(path)
+                if log:
+                    log(f"{done}/{len(todo)} generated")
+    index.save(path)
+    return index, failures
+
+
+def get_advice_index():
+    # Serving works without an index: every lookup just misses.
+    from utils import resource_utils as resources
+    try:
+        return resources.get("advice_index")
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute crew advice for common crops, classes and weather.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="generate the missing entries (resumable)")
+    build.add_argument("--classes", default=",".join(class_labels))
+    build.add_argument("--crops", default=",".join(CROPS))
+    build.add_argument("--languages", default="en", help="comma-separated language codes, e.g. en,sw,hi")
+    build.add_argument("--workers", type=int, default=8)
+    sub.add_parser("info", help="show the index version and size")
+    parser.add_argument("--path", default=ADVICE_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    if args.command == "info":
+        index = AdviceIndex.load(args.path)
+        kinds = {}
+        for key in index.entries:
+            kinds[key.split("|", 1)[0]] = kinds.get(key.split("|", 1)[0], 0) + 1
+        print(json.dumps({"path": args.path, "version": index.version, "created_at": index.created_at,
+                          "entries": len(index), "by_kind": kinds}, indent=2))
+        return
+
+    split = lambda value: [v.strip() for v in value.split(",") if v.strip()]
+    index, failures = build_index(args.path, split(args.classes), split(args.crops), split(args.languages),
+                                  workers=args.workers, log=log)
+    log(f"wrote {len(index)} entries to {args.path} ({failures} failed)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
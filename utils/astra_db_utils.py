@@ -1,36 +1,50 @@
 import os
 import streamlit as st
-import cassio
-from langchain.vectorstores.cassandra import Cassandra
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.docstore.document import Document
+from utils.lazy_utils import lazy_import
 
-def get_astra_vectorstore():
+cassio = lazy_import("cassio")
+cassandra_vectorstores = lazy_import("langchain.vectorstores.cassandra")
+langchain_embeddings = lazy_import("langchain.embeddings")
+langchain_docstore = lazy_import("langchain.docstore.document")
+
+def get_embeddings():
+    return langchain_embeddings.HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+def get_astra_vectorstore(embedding=None, table_name="plant_responses"):
     Astra_token = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
     Astra_DB_ID = os.getenv("ASTRA_DB_ID")
     if not Astra_token or not Astra_DB_ID:
         st.warning("Astra DB credentials are missing. Similarity search will not work.")
         return None
     cassio.init(database_id=Astra_DB_ID, token=Astra_token)
-    embedding = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    return Cassandra(
+    embedding = embedding or get_embeddings()
+    return cassandra_vectorstores.Cassandra(
         embedding=embedding,
-        table_name="plant_responses",
+        table_name=table_name,
         session=None,
         keyspace=None
     )
 
-def store_response(vectorstore, query, response):
+def store_response(vectorstore, query, response, metadata=None):
     if not vectorstore:
         return
     content = response.raw if hasattr(response, "raw") else str(response)
-    document = Document(page_content=content, metadata={"query": query})
+    document = langchain_docstore.Document(page_content=content, metadata={"query": query, **(metadata or {})})
     vectorstore.add_documents([document])
 
 def similarity_search(vectorstore, query, k=3):
     if not vectorstore:
         return "Astra DB is not configured."
-    docs = vectorstore.similarity_search(query, k=k)
+    return format_documents(vectorstore.similarity_search(query, k=k))
+
+def format_documents(docs):
     if not docs:
         return "No relevant treatments found in Astra DB."
-    return "\n\n".join([doc.page_content for doc in docs])
\ No newline at end of file
+    return "\n\n".join([doc.page_content for doc in docs])
+
+def find_response(vectorstore, query, metadata):
+    # Best stored response whose metadata matches exactly, or None.
+    if not vectorstore:
+        return None
+    docs = vectorstore.similarity_search(query, k=1, filter=metadata)
+    return docs[0] if docs else None
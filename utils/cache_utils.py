@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.astra_db_utils import find_response, store_response
+from utils.weather_utils import bucket_weather
+
+# Current conditions are refreshed by the weather provider every ~15 minutes.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "1800"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+
+WEATHER_FIELDS = ("Temperature", "Humidity", "Condition", "Wind", "UV_index")
+# Inputs each crew's prompts actually depend on.
+CACHE_FIELDS = {
+    "diagnosis": ("predicted_class", "name", "language") + WEATHER_FIELDS,
+    "recovery": ("predicted_class", "name", "language"),
+}
+
+
+def normalize_text(value):
+    return " ".join(re.sub(r"[^\w\s]", " ", str(value or "")).lower().split())
+
+
+def normalize_inputs(kind, inputs):
+    fields = CACHE_FIELDS[kind]
+    normalized = {field: normalize_text(inputs.get(field)) for field in fields if field not in WEATHER_FIELDS}
+    if any(field in WEATHER_FIELDS for field in fields):
+        normalized.update(bucket_weather(**{field: inputs.get(field) for field in WEATHER_FIELDS}))
+    return normalized
+
+
+def cache_key(kind, inputs):
+    normalized = normalize_inputs(kind, inputs)
+    payload = json.dumps([kind, normalized], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Three tiers, checked in order:
+    #   1. exact match on the normalized inputs (in-process LRU with TTL)
+    #   2. same inputs except the free-text plant name, whose embedding is close enough
+    #   3. exact match in the vectorstore, shared across processes; this is the
+    #      response_store collection, not the knowledge base the agents search
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 similarity_threshold=SIMILARITY_THRESHOLD, embeddings=None, vectorstore=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"exact": 0, "similar": 0, "persistent": 0, "miss": 0, "stale": 0}
+
+    def _partition(self, kind, normalized):
+        # Everything except the plant name must match for a similarity hit.
+        rest = {k: v for k, v in normalized.items() if k != "name"}
+        return json.dumps([kind, rest], sort_keys=True)
+
+    def _embed(self, text):
+        if not self.embeddings or not text:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, kind, inputs):
+        key = cache_key(kind, inputs)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > now:
+                self._entries.move_to_end(key)
+                self.stats["exact"] += 1
+                return entry["response"]
+
+        normalized = normalize_inputs(kind, inputs)
+        response = self._get_similar(kind, normalized, now)
+        if response is not None:
+            self.stats["similar"] += 1
+            return response
+
+        response = self._get_persistent(kind, key, normalized, now)
+        if response is not None:
+            self.stats["persistent"] += 1
+            self._remember(key, kind, normalized, response, now + self.ttl)
+            return response
+
+        self.stats["miss"] += 1
+        return None
+
+    def _get_similar(self, kind, normalized, now):
+        if not self.embeddings:
+            return None
+        partition = self._partition(kind, normalized)
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry["partition"] == partition and entry["expires_at"] > now and entry["vector"] is not None
+            ]
+        if not candidates:
+            return None
+        vector = self._embed(normalized.get("name"))
+        if vector is None:
+            return None
+        scores = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry["response"]
+
+    def _get_persistent(self, kind, key, normalized, now):
+        if not self.vectorstore:
+            return None
+        try:
+            doc = find_response(self.vectorstore, " ".join(normalized.values()), {"cache_key": key})
+        except Exception:
+            return None
+        if doc is None or float(doc.metadata.get("expires_at", 0)) <= now:
+            return None
+        return doc.page_content
+
+    def get_stale(self, kind, inputs):
+        # The last answer for exactly these inputs however old, for when no fresh one can be generated.
+        key = cache_key(kind, inputs)
+        with self._lock:
+            entry = self._entries.get(key)
+        response = entry["response"] if entry else None
+        if response is None and self.vectorstore:
+            try:
+                doc = find_response(self.vectorstore, " ".join(normalize_inputs(kind, inputs).values()), {"cache_key": key})
+            except Exception:
+                doc = None
+            response = doc.page_content if doc is not None else None
+        if response is not None:
+            self.stats["stale"] += 1
+        return response
+
+    def put(self, kind, inputs, response, observed_at=None):
+        # `observed_at` is when the weather behind these inputs was measured, so
+        # an answer never outlives the conditions it was written for.
+        key = cache_key(kind, inputs)
+        normalized = normalize_inputs(kind, inputs)
+        expires_at = (observed_at or time.time()) + self.ttl
+        self._remember(key, kind, normalized, response, expires_at)
+        if self.vectorstore:
+            try:
+                store_response(self.vectorstore, " ".join(normalized.values()), response, {
+                    "cache_key": key,
+                    "kind": kind,
+                    "expires_at": str(expires_at),
+                    "predicted_class": normalized.get("predicted_class"),
+                    "name": normalized.get("name"),
+                    "language": normalized.get("language"),
+                })
+            except Exception:
+                pass
+
+    def _remember(self, key, kind, normalized, response, expires_at):
+        entry = {
+            "response": response,
+            "expires_at": expires_at,
+            "partition": self._partition(kind, normalized),
+            "vector": self._embed(normalized.get("name")),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,324 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import admission_utils, policy_utils
+from utils import resource_utils as resources
+from utils.advice_utils import get_advice_index
+from utils.lazy_utils import lazy_import
+from utils.retrieval_utils import Retriever, filters_for, retrieval_filters
+from utils.trace_utils import span
+
+crewai = lazy_import("crewai")
+
+CREW_WORKERS = int(os.getenv("CREW_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=CREW_WORKERS, thread_name_prefix="crew")
+# Batch crews get threads of their own so a large job never holds every crew thread while
+# interactive crews queue behind it; which crew calls the LLM next is up to admission priority.
+_batch_executor = ThreadPoolExecutor(max_workers=CREW_WORKERS, thread_name_prefix="crew-batch")
+
+# Crew kind -> (agent resource, task resource)
+CREWS = {
+    "diagnosis": ("agriculture_agent", "diagnosis_task"),
+    "recovery": ("recovery_agent", "recovery_task"),
+}
+
+COMBINED_PROMPT = """You are an agriculture expert helping a farmer whose {name} plant shows {predicted_class}.
+Answer in the language with code "{language}".
+
+Current weather:
+- Temperature: {Temperature}°C
+- Condition: {Condition}
+- Humidity: {Humidity}%
+- Wind: {Wind}
+- UV Index: {UV_index}
+
+Reference notes from the knowledge base:
+{context}
+
+Reply with a JSON object with exactly these string fields, each formatted as Markdown:
+- "diagnosis": weather-aware prevention and treatment steps for {predicted_class} on {name}.
+- "recovery": fertilizers, nutrients, application tips and timing to help {name} recover after {predicted_class}.
+"""
+
+BUSY_NOTE = ("AgriGPT is very busy right now, so this answer is based on the detected condition only "
+             "and does not take your weather into account. Please try again in a few minutes for tailored advice.")
+BUDGET_NOTE = ("Tailored advice for this photo needed more work than one diagnosis is allowed, so this answer "
+               "is based on the detected condition only and does not take your weather into account.")
+
+
+def crew_inputs(predicted_class, name, language, Temperature=None, Condition=None, Humidity=None, Wind=None, UV_index=None):
+    return {
+        'question': predicted_class,
+        'predicted_class': predicted_class,
+        'name': name,
+        'language': language,
+        'Temperature': Temperature,
+        'Condition': Condition,
+        'Humidity': Humidity,
+        'Wind': Wind,
+        'UV_index': UV_index,
+    }
+
+
+def build_crew(kind, step_callback=None):
+    # The registry's agent and task are templates: CrewAI interpolates inputs into them,
+    # counts executions on them and keeps the first crew's step_callback on the agent for
+    # good, so every run gets copies of its own.
+    agent_name, task_name = CREWS[kind]
+    agent = resources.get(agent_name).copy()
+    task = resources.get(task_name).copy([agent], {})
+    return crewai.Crew(agents=[agent], tasks=[task], step_callback=step_callback)
+
+
+def get_response_cache():
+    # The crews still work, just uncached, if the cache cannot be built.
+    try:
+        return resources.get("response_cache")
+    except Exception:
+        return None
+
+
+def from_index(kind, inputs):
+    index = get_advice_index()
+    if index is None:
+        return None
+    with span("advice_index.get", kind=kind):
+        return index.get(kind, inputs)
+
+
+def kickoff(kind, inputs, observed_at=None, cache=None, step_callback=None, use_index=True):
+    with span("crew.kickoff", kind=kind) as record:
+        # Precomputed advice first; live generation only for combinations the index lacks
+        if use_index:
+            indexed = from_index(kind, inputs)
+            if indexed is not None:
+                record["attributes"].update(cached=True, source="index")
+                return indexed
+        cache = cache if cache is not None else get_response_cache()
+        if cache is not None:
+            with span("response_cache.get", kind=kind):
+                cached = cache.get(kind, inputs)
+            if cached is not None:
+                record["attributes"]["cached"] = True
+                return cached
+        record["attributes"]["cached"] = False
+        # Shed before starting a crew that would only queue behind a full LLM pool
+        admission_utils.get_controller().check("llm")
+        with retrieval_filters(**filters_for(inputs)):
+            result = build_crew(kind, step_callback).kickoff(inputs)
+        response = result.raw if hasattr(result, "raw") else str(result)
+        if cache is not None:
+            cache.put(kind, inputs, response, observed_at=observed_at)
+        return response
+
+
+def kickoff_combined(kinds, inputs, observed_at=None, cache=None):
+    # One retrieval and one JSON-mode LLM call instead of a tool loop per crew.
+    with span("crew.combined", kinds=",".join(kinds)) as record:
+        cache = cache if cache is not None else get_response_cache()
+        results = {}
+        for kind in kinds:
+            indexed = from_index(kind, inputs)
+            if indexed is not None:
+                results[kind] = indexed
+            elif cache is not None:
+                cached = cache.get(kind, inputs)
+                if cached is not None:
+                    results[kind] = cached
+        record["attributes"]["cached"] = len(results) == len(kinds)
+        if len(results) == len(kinds):
+            return results
+        admission_utils.get_controller().check("llm")
+        tool = resources.get("knowledge_tool")
+        query = f"{inputs['predicted_class']} {inputs['name']}".strip()
+        with retrieval_filters(**filters_for(inputs)):
+            context = policy_utils.dedup_tool_call(tool.name, query, lambda: tool.search(query))
+        prompt = COMBINED_PROMPT.format(context=context, **inputs)
+        content = resources.get("combined_llm").call([{"role": "user", "content": prompt}])
+        try:
+            answer = json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            raise ValueError("The combined answer was not valid JSON")
+        for kind in kinds:
+            if kind in results:
+                continue
+            if not answer.get(kind):
+                raise ValueError(f"The combined answer has no {kind} section")
+            results[kind] = str(answer[kind])
+            if cache is not None:
+                cache.put(kind, inputs, results[kind], observed_at=observed_at)
+        return results
+
+
+def class_only_answer(kind, inputs, note=BUSY_NOTE):
+    # Knowledge-base notes for the detected class, found without calling the LLM.
+    name = inputs.get("name")
+    parts = [f"_{note}_", f"**Detected:** {inputs['predicted_class']}" + (f" on {name}" if name else "")]
+    try:
+        filters = filters_for(inputs)
+        docs = Retriever(resources.get("vectorstore")).search(f"{inputs['predicted_class']} {name or ''}".strip(), filter=filters)
+    except Exception:
+        docs = []
+    if docs:
+        parts.append("**Notes from the knowledge base:**\n\n" + "\n\n".join(doc.page_content for doc in docs))
+    return "\n\n".join(parts)
+
+
+def degraded_answer(kind, inputs, cache=None, note=BUSY_NOTE):
+    # What a crew shed by admission control, or out of budget, answers instead, as
+    # (response, source): the last answer for these inputs however old, precomputed
+    # advice for the same class and crop under other weather, or notes on the
+    # detected class alone.
+    with span("crew.degraded", kind=kind) as record:
+        cache = cache if cache is not None else get_response_cache()
+        response, source = None, "class_only"
+        if cache is not None:
+            response, source = cache.get_stale(kind, inputs), "stale_cache"
+        if response is None:
+            index = get_advice_index()
+            response, source = (index.nearest(kind, inputs) if index is not None else None), "index"
+        if response is None:
+            response, source = class_only_answer(kind, inputs, note), "class_only"
+        record["attributes"]["source"] = source
+        admission_utils.get_controller().degraded()
+        return response, source
+
+
+class CrewCancelled(Exception):
+    pass
+
+
+def _step_text(step):
+    for attr in ("output", "result", "thought", "text"):
+        value = getattr(step, attr, None)
+        if value:
+            return str(value)
+    return str(step)
+
+
+class CrewRun:
+    # Runs several crews at once on the shared pool. Progress is recorded on the
+    # run itself so a Streamlit rerun can pick up where the last one left off.
+    # All crews of a run share one token/call budget and tool-call memo (`scope`).
+    def __init__(self, jobs, observed_at=None, key=None, mode=None):
+        self.key = key
+        self.partials = {kind: [] for kind in jobs}
+        self.results = {}
+        self.errors = {}
+        # Crews shed under load answer with degraded_answer(); kind -> where that answer came from
+        self.degraded = {}
+        # The kinds among them that admission control shed; unlike a spent budget, load passes
+        self.shed = set()
+        self.scope = policy_utils.RunScope()
+        self._cancelled = threading.Event()
+        self._updates = queue.Queue()
+        mode = mode or policy_utils.CREW_MODE
+        inputs = list(jobs.values())
+        # Each crew runs in a copy of the caller's context so its spans join the caller's trace.
+        if mode == "combined" and len(jobs) > 1 and all(i == inputs[0] for i in inputs):
+            future = self._submit(self._run_combined, tuple(jobs), inputs[0], observed_at)
+            self._futures = {kind: future for kind in jobs}
+        else:
+            self._futures = {kind: self._submit(self._run, kind, inputs, observed_at) for kind, inputs in jobs.items()}
+
+    @classmethod
+    def finished(cls, results, key=None):
+        # A run whose answers are already known, e.g. restored from the result store.
+        run = cls({}, key=key)
+        run.partials = {kind: [] for kind in results}
+        run.results = dict(results)
+        return run
+
+    def _submit(self, fn, *args):
+        executor = _batch_executor if admission_utils.current_priority() == admission_utils.BATCH else _executor
+        return executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _run(self, kind, inputs, observed_at):
+        try:
+            if self._cancelled.is_set():
+                raise CrewCancelled()
+            with policy_utils.activate(self.scope):
+                self.results[kind] = kickoff(kind, inputs, observed_at=observed_at,
+                                             step_callback=lambda step: self._on_step(kind, step))
+        except admission_utils.Overloaded:
+            self.results[kind], self.degraded[kind] = degraded_answer(kind, inputs)
+            self.shed.add(kind)
+        except policy_utils.BudgetExceeded:
+            self.results[kind], self.degraded[kind] = degraded_answer(kind, inputs, note=BUDGET_NOTE)
+        except Exception as e:
+            self.errors[kind] = e
+        finally:
+            self._updates.put(kind)
+
+    def _run_combined(self, kinds, inputs, observed_at):
+        try:
+            if self._cancelled.is_set():
+                raise CrewCancelled()
+            with policy_utils.activate(self.scope):
+                self.results.update(kickoff_combined(kinds, inputs, observed_at=observed_at))
+        except (admission_utils.Overloaded, policy_utils.BudgetExceeded) as e:
+            note = BUSY_NOTE if isinstance(e, admission_utils.Overloaded) else BUDGET_NOTE
+            for kind in kinds:
+                if kind not in self.results:
+                    self.results[kind], self.degraded[kind] = degraded_answer(kind, inputs, note=note)
+                    if note is BUSY_NOTE:
+                        self.shed.add(kind)
+        except Exception as e:
+            for kind in kinds:
+                self.errors[kind] = e
+        finally:
+            for kind in kinds:
+                self._updates.put(kind)
+
+    def _on_step(self, kind, step):
+        # Raising here is the only way to stop a crew that is already running.
+        if self._cancelled.is_set():
+            raise CrewCancelled()
+        self.partials[kind].append(_step_text(step))
+        self._updates.put(kind)
+
+    def done(self, kind=None):
+        if kind is not None:
+            return kind in self.results or kind in self.errors
+        return all(self.done(k) for k in self._futures)
+
+    def updates(self, poll_interval=0.25):
+        # Yields the kind of crew that made progress, until every crew has finished.
+        while not self.done() and not self._cancelled.is_set():
+            try:
+                yield self._updates.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+        while not self._updates.empty():
+            yield self._updates.get_nowait()
+
+    def add_done_callback(self, fn):
+        # Calls fn(run) once every crew has finished, been cancelled or failed.
+        futures = set(self._futures.values())
+        if not futures:
+            fn(self)
+            return
+        lock, remaining = threading.Lock(), [len(futures)]
+
+        def finished(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                fn(self)
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def cancel(self):
+        self._cancelled.set()
+        for future in self._futures.values():
+            future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
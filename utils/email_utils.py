@@ -1,9 +1,31 @@
 import os
 import streamlit as st
-import smtplib
+from utils.lazy_utils import lazy_import
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+smtplib = lazy_import("smtplib")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+# Set SMTP_SSL=0 for a plain local server such as aiosmtpd
+SMTP_SSL = os.getenv("SMTP_SSL", "1") != "0"
+
+def build_message(sender, recipient_email, subject, body):
+    msg = MIMEMultipart()
+    msg["From"] = sender
+    msg["To"] = recipient_email
+    msg["Subject"] = subject
+
+    msg.attach(MIMEText(body, "html"))
+    return msg
+
+def connect_smtp(sender, password, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL, timeout=30):
+    server = smtplib.SMTP_SSL(host, port, timeout=timeout) if use_ssl else smtplib.SMTP(host, port, timeout=timeout)
+    if password:
+        server.login(sender, password)
+    return server
+
 def send_email(recipient_email, subject, body):
     email_sender = os.getenv("EMAIL_ADDRESS")
     email_password = os.getenv("EMAIL_PASSWORD")
@@ -12,18 +34,12 @@ def send_email(recipient_email, subject, body):
         st.error("Email credentials not configured")
         return False
 
-    msg = MIMEMultipart()
-    msg["From"] = email_sender
-    msg["To"] = recipient_email
-    msg["Subject"] = subject
-
-    msg.attach(MIMEText(body, "html"))
+    msg = build_message(email_sender, recipient_email, subject, body)
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(email_sender, email_password)
+        with connect_smtp(email_sender, email_password) as server:
             server.sendmail(email_sender, recipient_email, msg.as_string())
         return True
     except Exception as e:
         st.error(f"Failed to send email: {e}")
-        return False
\ No newline at end of file
+        return False
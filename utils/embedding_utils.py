@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.batch_utils import MicroBatcher
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+
+
+class CachedEmbeddings:
+    # Wraps a LangChain embeddings object (embed_query / embed_documents).
+    #
+    # Vectors are cached by a hash of the model name and text, in a bounded LRU
+    # and optionally in a SQLite file that survives restarts. Cache misses from
+    # all threads are merged into one embed_documents call by a MicroBatcher.
+    # all-MiniLM-L6-v2 encodes queries and documents the same way, so queries
+    # share the cache and the batches.
+
+    def __init__(self, embeddings, max_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH,
+                 max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+        self._batcher = MicroBatcher(self._encode, max_batch_size, max_wait_ms, name="embedding-encoder")
+        self.stats = {"hits": 0, "misses": 0, "batches": 0}
+
+    def __getattr__(self, attr):
+        if attr == "embeddings":
+            raise AttributeError(attr)
+        return getattr(self.embeddings, attr)
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _encode(self, texts):
+        unique = list(dict.fromkeys(texts))
+        vectors = dict(zip(unique, self.embeddings.embed_documents(unique)))
+        self.stats["batches"] += 1
+        return [vectors[text] for text in texts]
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                return vector
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self._remember(key, vector, persist=False)
+        return vector
+
+    def _remember(self, key, vector, persist=True):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if persist and self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                                 (key, np.asarray(vector, dtype=np.float32).tobytes()))
+                self._db.commit()
+
+    def embed_documents(self, texts):
+        results = []
+        pending = []
+        for text in texts:
+            key = self._key(text)
+            vector = self._lookup(key)
+            if vector is None:
+                self.stats["misses"] += 1
+                pending.append((len(results), key, self._batcher.submit(text)))
+            else:
+                self.stats["hits"] += 1
+            results.append(vector)
+        for index, key, future in pending:
+            vector = list(future.result())
+            self._remember(key, vector)
+            results[index] = vector
+        return results
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self._batcher.close()
+        if self._db is not None:
+            self._db.close()
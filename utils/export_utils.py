@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from utils.image_utils import preprocess_batch
+from utils.inference_utils import MODEL_PATHS, class_labels, iter_images, load_keras_model, load_pathogen_model
+
+QUANTIZATION_MODES = ("none", "dynamic", "float16", "int8")
+
+
+def sample_batch(directory, limit=64):
+    paths = []
+    for path in iter_images(directory):
+        paths.append(path)
+        if len(paths) >= limit:
+            break
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    batch, errors = preprocess_batch(paths)
+    keep = [i for i in range(len(paths)) if i not in errors]
+    return batch[keep]
+
+
+def export_tflite(model, path, quantization="none", samples=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if samples is None or not len(samples):
+            raise ValueError("int8 quantization needs sample images for calibration")
+        converter.representative_dataset = lambda: ([samples[i:i + 1]] for i in range(len(samples)))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    return path
+
+
+def export_onnx(model, path, quantization="none"):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=path)
+    if quantization in ("dynamic", "int8"):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, path, weight_type=QuantType.QInt8)
+    elif quantization == "float16":
+        raise ValueError("float16 quantization is only supported for TFLite")
+    return path
+
+
+def _timed_predict(model, batch):
+    model.predict(batch[:1], verbose=0)
+    start = time.perf_counter()
+    predictions = model.predict(batch, verbose=0)
+    return np.asarray(predictions), (time.perf_counter() - start) / len(batch) * 1000
+
+
+def check_parity(reference, candidate, batch):
+    expected, reference_ms = _timed_predict(reference, batch)
+    actual, candidate_ms = _timed_predict(candidate, batch)
+    diff = np.abs(expected - actual)
+    return {
+        "samples": int(len(batch)),
+        "top1_agreement": float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "reference_ms_per_image": reference_ms,
+        "candidate_ms_per_image": candidate_ms,
+        "classes": class_labels,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the pathogen classifier to TFLite or ONNX.")
+    parser.add_argument("--format", choices=["tflite", "onnx"], default="tflite")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="none")
+    parser.add_argument("--model", default=MODEL_PATHS["keras"])
+    parser.add_argument("--output")
+    parser.add_argument("--samples", help="directory of leaf photos for int8 calibration and the parity check")
+    parser.add_argument("--sample-limit", type=int, default=64)
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="exit with an error if top-1 agreement with the Keras model is lower")
+    args = parser.parse_args(argv)
+
+    output = args.output or MODEL_PATHS[args.format]
+    samples = sample_batch(args.samples, args.sample_limit) if args.samples else None
+    model = load_keras_model(args.model)
+    if args.format == "tflite":
+        export_tflite(model, output, args.quantize, samples)
+    else:
+        export_onnx(model, output, args.quantize)
+    print(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB, quantization: {args.quantize})")
+
+    if samples is None:
+        print("No --samples given; skipped the accuracy parity check.")
+        return
+    report = check_parity(model, load_pathogen_model(output, ensemble=[]), samples)
+    print(json.dumps(report, indent=2))
+    if report["top1_agreement"] < args.min_agreement:
+        raise SystemExit(f"Top-1 agreement {report['top1_agreement']:.3f} is below {args.min_agreement}")
+
+
+if __name__ == "__main__":
+    main()
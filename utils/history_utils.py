@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.cache_utils import RESPONSE_CACHE_TTL, normalize_inputs
+
+HISTORY_PATH = os.getenv("HISTORY_PATH", "diagnosis_history.db")
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))
+# Stored diagnoses and predictions (with their thumbnails) are deleted after this many seconds,
+# and the oldest beyond HISTORY_MAX_ENTRIES diagnoses plus as many predictions no diagnosis
+# refers to; 0 keeps them. A prediction is kept as long as a kept diagnosis refers to it.
+HISTORY_RETENTION = float(os.getenv("HISTORY_RETENTION", str(30 * 86400)))
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "10000"))
+# Seconds between prunes while the store is in use
+PRUNE_INTERVAL = 3600
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def result_key(image_digest, inputs):
+    # Same photo, same prompt inputs (weather bucketed as for the response cache) -> same result.
+    payload = json.dumps([image_digest, normalize_inputs("diagnosis", inputs)], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultStore:
+    # Predictions per image content hash and finished diagnoses per (image, inputs),
+    # kept in SQLite so a rerun, a re-upload or a later visit does not recompute them.
+
+    def __init__(self, path=HISTORY_PATH, max_age=RESPONSE_CACHE_TTL, retention=HISTORY_RETENTION,
+                 max_entries=HISTORY_MAX_ENTRIES):
+        self.max_age = max_age
+        self.retention = retention
+        self.max_entries = max_entries
+        self._pruned_at = 0.0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS predictions (
+                    image_hash TEXT, model TEXT, prediction TEXT, thumbnail BLOB, created_at REAL,
+                    PRIMARY KEY (image_hash, model)
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    id TEXT PRIMARY KEY, key TEXT, session_id TEXT, image_hash TEXT, model TEXT,
+                    created_at REAL, inputs TEXT, location TEXT, results TEXT
+                );
+                CREATE INDEX IF NOT EXISTS results_key ON results (key, created_at);
+                CREATE INDEX IF NOT EXISTS results_session ON results (session_id, created_at);
+                CREATE INDEX IF NOT EXISTS results_created ON results (created_at);
+                CREATE INDEX IF NOT EXISTS results_image ON results (image_hash, model);
+                CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created_at);
+            """)
+            self._db.commit()
+        self.prune()
+
+    def prune(self):
+        # Drops diagnoses past the retention period or over `max_entries`, then the predictions
+        # (and thumbnails) no remaining diagnosis refers to that are past it or over `max_entries`.
+        unreferenced = """
+            NOT EXISTS (SELECT 1 FROM results r WHERE r.image_hash = predictions.image_hash AND r.model = predictions.model)
+        """
+        with self._lock:
+            self._pruned_at = time.time()
+            if self.retention:
+                self._db.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.retention,))
+            if self.max_entries:
+                self._db.execute(
+                    "DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            if self.retention:
+                self._db.execute(f"DELETE FROM predictions WHERE created_at < ? AND {unreferenced}",
+                                 (time.time() - self.retention,))
+            if self.max_entries:
+                self._db.execute(
+                    f"DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions WHERE {unreferenced} "
+                    "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._db.commit()
+
+    def _maybe_prune(self):
+        if time.time() - self._pruned_at >= PRUNE_INTERVAL:
+            self.prune()
+
+    def get_prediction(self, image_digest, model):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT prediction, thumbnail FROM predictions WHERE image_hash = ? AND model = ?",
+                (image_digest, model),
+            ).fetchone()
+        return (json.loads(row["prediction"]), row["thumbnail"]) if row else (None, None)
+
+    def put_prediction(self, image_digest, model, prediction, thumbnail=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                (image_digest, model, json.dumps(prediction), thumbnail, time.time()),
+            )
+            self._db.commit()
+        self._maybe_prune()
+
+    def get_results(self, key, max_age=None):
+        # Newest stored answer for these inputs, if it is recent enough to reuse.
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results FROM results WHERE key = ? AND created_at > ? ORDER BY created_at DESC LIMIT 1",
+                (key, time.time() - max_age),
+            ).fetchone()
+        return json.loads(row["results"]) if row else None
+
+    def put_results(self, key, session_id, image_digest, model, inputs, results, location=None):
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry_id, key, session_id, image_digest, model, time.time(),
+                 json.dumps(inputs, default=str), location, json.dumps(results)),
+            )
+            self._db.commit()
+        self._maybe_prune()
+        return entry_id
+
+    def history(self, session_id=None, limit=HISTORY_LIMIT):
+        query = """
+            SELECT r.id, r.created_at, r.inputs, r.location, r.results, p.prediction, p.thumbnail
+            FROM results r LEFT JOIN predictions p ON p.image_hash = r.image_hash AND p.model = r.model
+        """
+        params = ()
+        if session_id is not None:
+            query += " WHERE r.session_id = ?"
+            params = (session_id,)
+        query += " ORDER BY r.created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, (*params, limit)).fetchall()
+        return [{
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "inputs": json.loads(row["inputs"]),
+            "location": row["location"],
+            "results": json.loads(row["results"]),
+            "prediction": json.loads(row["prediction"]) if row["prediction"] else None,
+            "thumbnail": row["thumbnail"],
+        } for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,142 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.trace_utils import span
+
+IMAGE_SIZE = (150, 150)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+THUMBNAIL_SIZE = (480, 480)
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# PIL releases the GIL while decoding and resizing, so threads decode in parallel.
+_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="image-decode")
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+def _to_rgb(img):
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        # Transparent areas become white rather than black
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def load_image(src, size=IMAGE_SIZE):
+    with span("image.decode"):
+        img = src if isinstance(src, Image.Image) else Image.open(src)
+        if img.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that is still larger than `size`
+            img.draft("RGB", size)
+        img = ImageOps.exif_transpose(img)
+        img = _to_rgb(img)
+        if img.size != tuple(size):
+            img = img.resize(size)
+        return img
+
+
+def to_array(img, out=None):
+    pixels = np.asarray(img)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.multiply(pixels, np.float32(1 / 255.0), out=out, casting="unsafe")
+    return out
+
+
+def preprocess_image(src, size=IMAGE_SIZE):
+    return to_array(load_image(src, size))
+
+
+def _preprocess_into(src, size, out):
+    to_array(load_image(src, size), out=out)
+
+
+def preprocess_batch(sources, size=IMAGE_SIZE, out=None):
+    # Decodes every source straight into one float32 (N, height, width, 3) buffer.
+    # Returns the buffer and {index: exception} for sources that failed to decode;
+    # their rows are left zeroed.
+    sources = list(sources)
+    shape = (len(sources), size[1], size[0], 3)
+    if out is None or out.shape[0] < len(sources):
+        out = np.zeros(shape, dtype=np.float32)
+    else:
+        out = out[:len(sources)]
+    futures = [_executor.submit(_preprocess_into, src, size, out[i]) for i, src in enumerate(sources)]
+    errors = {}
+    for i, future in enumerate(futures):
+        try:
+            future.result()
+        except Exception as e:
+            out[i] = 0
+            errors[i] = e
+    return out, errors
+
+
+def _byte_size(src):
+    size = getattr(src, "size", None)
+    if isinstance(size, int):
+        return size
+    if isinstance(src, (str, os.PathLike)):
+        return os.path.getsize(src)
+    if isinstance(src, (bytes, bytearray)):
+        return len(src)
+    position = src.tell()
+    size = src.seek(0, io.SEEK_END)
+    src.seek(position)
+    return size
+
+
+class IngestedImage:
+    # What a session keeps of an upload: the model input and a small JPEG to display.
+    __slots__ = ("array", "thumbnail", "width", "height")
+
+    def __init__(self, array, thumbnail, width, height):
+        self.array = array
+        self.thumbnail = thumbnail
+        self.width = width
+        self.height = height
+
+
+def ingest_image(src, size=IMAGE_SIZE, thumbnail_size=THUMBNAIL_SIZE):
+    # Checks the upload against MAX_IMAGE_BYTES and MAX_IMAGE_PIXELS before decoding it,
+    # decodes it once at no more than the thumbnail's resolution, and closes the original.
+    if _byte_size(src) > MAX_IMAGE_BYTES:
+        raise ImageRejected(f"Image is larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    with span("image.ingest"):
+        try:
+            original = Image.open(src)
+        except Exception as e:
+            raise ImageRejected(f"Unreadable image: {e}")
+        with original:
+            width, height = original.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ImageRejected(f"Image is {width}x{height}; at most {MAX_IMAGE_PIXELS // 1_000_000} megapixels are accepted")
+            try:
+                target = thumbnail_size or size
+                if original.format == "JPEG":
+                    original.draft("RGB", (max(target[0], size[0]), max(target[1], size[1])))
+                img = _to_rgb(ImageOps.exif_transpose(original))
+                array = to_array(img.resize(size))
+            except Exception as e:
+                raise ImageRejected(f"Unreadable image: {e}")
+            thumbnail = None
+            if thumbnail_size:
+                img.thumbnail(thumbnail_size)
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", quality=85)
+                thumbnail = buffer.getvalue()
+        return IngestedImage(array, thumbnail, width, height)
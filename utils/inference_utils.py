@@ -0,0 +1,275 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from utils.batch_utils import MicroBatcher
+from utils.image_utils import IMAGE_EXTENSIONS, preprocess_batch
+from utils.trace_utils import span
+
+class_labels = ["Bacteria", "Fungus", "Healthy", "Pests", "Virus"]
+
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "keras")
+MODEL_PATHS = {
+    "keras": "pathogen_classifier.h5",
+    "tflite": "pathogen_classifier.tflite",
+    "onnx": "pathogen_classifier.onnx",
+}
+MODEL_PATH = os.getenv("MODEL_PATH", MODEL_PATHS.get(MODEL_BACKEND, MODEL_PATHS["keras"]))
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+# Extra model files whose probabilities are averaged with MODEL_PATH's, comma-separated
+MODEL_ENSEMBLE = [p.strip() for p in os.getenv("MODEL_ENSEMBLE", "").split(",") if p.strip()]
+# Test-time augmentation views, e.g. "hflip,vflip,rot90,crop" ("all" for every view)
+TTA = os.getenv("INFERENCE_TTA", "")
+# Below this confidence (in %) a prediction is flagged, or its crews skipped with LOW_CONFIDENCE_ACTION=skip
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "50"))
+LOW_CONFIDENCE_ACTION = os.getenv("LOW_CONFIDENCE_ACTION", "flag")
+
+
+def load_keras_model(path=MODEL_PATHS["keras"]):
+    from keras.models import load_model
+    from keras.layers import InputLayer
+    return load_model(path, compile=False, custom_objects={"InputLayer": InputLayer})
+
+
+def _tflite_interpreter(path):
+    # Prefer the standalone runtimes, which do not pull in TensorFlow.
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+    return Interpreter(model_path=path, num_threads=os.cpu_count())
+
+
+def _batch_bucket(size):
+    # Batch sizes are padded up to a power of two, so only a handful of shapes are ever allocated.
+    return 1 << max(0, int(size) - 1).bit_length()
+
+
+class TFLiteModel:
+    # Exposes the `predict(batch, verbose=0)` call the app makes on a Keras model.
+    # Resizing an interpreter reallocates all of its tensors, so instead of resizing
+    # for every micro-batch size there is one interpreter per padded batch size.
+    def __init__(self, path):
+        self.path = path
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interpreter = _tflite_interpreter(path)
+        interpreter.allocate_tensors()
+        self._interpreters[int(interpreter.get_input_details()[0]["shape"][0])] = interpreter
+
+    def _interpreter(self, bucket, shape):
+        interpreter = self._interpreters.get(bucket)
+        if interpreter is None:
+            interpreter = _tflite_interpreter(self.path)
+            interpreter.resize_tensor_input(interpreter.get_input_details()[0]["index"], (bucket, *shape))
+            interpreter.allocate_tensors()
+            self._interpreters[bucket] = interpreter
+        return interpreter
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        size = len(batch)
+        bucket = _batch_bucket(size)
+        if bucket != size:
+            batch = np.concatenate([batch, np.zeros((bucket - size, *batch.shape[1:]), dtype=np.float32)])
+        with self._lock:
+            interpreter = self._interpreter(bucket, batch.shape[1:])
+            input_details = interpreter.get_input_details()[0]
+            output_details = interpreter.get_output_details()[0]
+            scale, zero_point = input_details["quantization"]
+            if scale:
+                batch = np.round(batch / scale + zero_point)
+            interpreter.set_tensor(input_details["index"], batch.astype(input_details["dtype"]))
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details["index"])[:size].astype(np.float32)
+        scale, zero_point = output_details["quantization"]
+        if scale:
+            output = (output - zero_point) * scale
+        return output
+
+
+class OnnxModel:
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, verbose=0):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+class EnsembleModel:
+    # Averages the class probabilities of several models, which may use different backends.
+    def __init__(self, models):
+        self.models = list(models)
+
+    def predict(self, batch, verbose=0):
+        return np.mean([np.asarray(model.predict(batch, verbose=0), dtype=np.float32) for model in self.models], axis=0)
+
+
+def _load_model_file(path):
+    if path.endswith(".tflite"):
+        return TFLiteModel(path)
+    if path.endswith(".onnx"):
+        return OnnxModel(path)
+    return load_keras_model(path)
+
+
+def load_pathogen_model(path=None, backend=None, ensemble=None):
+    backend = backend or MODEL_BACKEND
+    path = path or (MODEL_PATH if backend == MODEL_BACKEND else MODEL_PATHS[backend])
+    ensemble = MODEL_ENSEMBLE if ensemble is None else ensemble
+    if ensemble:
+        return EnsembleModel([_load_model_file(p) for p in [path, *ensemble]])
+    return _load_model_file(path)
+
+
+def _center_crop(img, ratio=0.875):
+    # Zooms into the centre and scales back up (nearest neighbour) so the view keeps the input shape.
+    height, width = img.shape[:2]
+    rows = np.linspace((1 - ratio) / 2 * height, (1 + ratio) / 2 * height - 1, height).round().astype(int)
+    cols = np.linspace((1 - ratio) / 2 * width, (1 + ratio) / 2 * width - 1, width).round().astype(int)
+    return img[rows][:, cols]
+
+
+TTA_VIEWS = {
+    "hflip": lambda img: img[:, ::-1],
+    "vflip": lambda img: img[::-1],
+    "rot90": lambda img: np.rot90(img, 1),
+    "rot270": lambda img: np.rot90(img, 3),
+    "crop": _center_crop,
+}
+
+
+def parse_views(spec):
+    if not spec or spec == "0":
+        return ()
+    if spec in ("1", "all"):
+        return tuple(TTA_VIEWS)
+    views = tuple(v.strip() for v in spec.split(",") if v.strip())
+    unknown = [v for v in views if v not in TTA_VIEWS]
+    if unknown:
+        raise ValueError(f"Unknown TTA views: {', '.join(unknown)}; choose from {', '.join(TTA_VIEWS)}")
+    return views
+
+
+def augment(img, views):
+    # The original image followed by one augmented copy per view; rotations need a square input.
+    return np.stack([img, *(TTA_VIEWS[view](img) for view in views)])
+
+
+def decode_predictions(predictions, threshold=CONFIDENCE_THRESHOLD):
+    results = []
+    for row in np.asarray(predictions):
+        idx = int(np.argmax(row))
+        confidence = float(row[idx]) * 100
+        results.append({
+            "predicted_class": class_labels[idx],
+            "confidence": confidence,
+            "probabilities": {label: float(p) for label, p in zip(class_labels, row)},
+            "low_confidence": confidence < threshold,
+        })
+    return results
+
+
+def model_signature():
+    # Identifies the setup that produced a prediction, so stored predictions are not reused across models.
+    return "|".join([MODEL_PATH, *MODEL_ENSEMBLE, TTA, str(CONFIDENCE_THRESHOLD)])
+
+
+def should_run_crews(prediction, action=LOW_CONFIDENCE_ACTION):
+    return not (prediction.get("low_confidence") and action == "skip")
+
+
+class BatchClassifier:
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, views=None):
+        self.model = model
+        self.views = parse_views(TTA) if views is None else tuple(views)
+        self._batcher = MicroBatcher(self._predict_batch, max_batch_size, max_wait_ms, name="pathogen-classifier")
+
+    def _predict_batch(self, arrays):
+        batch = np.asarray(np.stack([a[0] if a.ndim == 4 else a for a in arrays]), dtype=np.float32)
+        if self.views:
+            # Every view of every image goes through the model in the same predict call
+            batch = np.concatenate([augment(img, self.views) for img in batch])
+        with span("model.predict", batch_size=len(batch)):
+            predictions = np.asarray(self.model.predict(batch, verbose=0), dtype=np.float32)
+        if self.views:
+            predictions = predictions.reshape(len(arrays), len(self.views) + 1, -1).mean(axis=1)
+        return decode_predictions(predictions)
+
+    def submit(self, img_array):
+        return self._batcher.submit(np.asarray(img_array))
+
+    def classify(self, img_array, timeout=None):
+        return self.submit(img_array).result(timeout=timeout)
+
+    def close(self):
+        self._batcher.close()
+
+
+def iter_images(directory):
+    for root, _, files in os.walk(directory):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, file_name)
+
+
+def classify_directory(classifier, directory, chunk_size=MAX_BATCH_SIZE):
+    return classify_paths(classifier, iter_images(directory), chunk_size)
+
+
+def classify_paths(classifier, paths, chunk_size=MAX_BATCH_SIZE):
+    # Paths are consumed lazily, one chunk at a time, so any iterable of any length works.
+    paths = iter(paths)
+    buffer = None
+    while True:
+        chunk = list(itertools.islice(paths, chunk_size))
+        if not chunk:
+            return
+        buffer, errors = preprocess_batch(chunk, out=buffer)
+        futures = [None if i in errors else classifier.submit(buffer[i]) for i in range(len(chunk))]
+        for i, (path, future) in enumerate(zip(chunk, futures)):
+            if future is None:
+                yield {"image": path, "error": f"Failed to read image: {errors[i]}"}
+                continue
+            try:
+                yield {"image": path, **future.result()}
+            except Exception as e:
+                yield {"image": path, "error": f"Prediction failed: {e}"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify every leaf photo in a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--model", default=MODEL_PATH, help=".h5, .tflite or .onnx file")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--ensemble", nargs="*", default=None, help="extra model files to average with --model")
+    parser.add_argument("--tta", default=TTA, help=f"comma-separated views ({','.join(TTA_VIEWS)}) or 'all'")
+    parser.add_argument("--output", help="JSONL file to write (defaults to stdout)")
+    args = parser.parse_args(argv)
+
+    model = load_pathogen_model(args.model, ensemble=args.ensemble)
+    classifier = BatchClassifier(model, args.batch_size, args.max_wait_ms, views=parse_views(args.tta))
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in classify_directory(classifier, args.directory, args.batch_size):
+            out.write(json.dumps(result) + "\n")
+    finally:
+        classifier.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import importlib
+import threading
+import time
+import types
+
+# Seconds spent importing each lazily loaded module, in load order.
+load_times = {}
+
+
+class LazyModule(types.ModuleType):
+    # Stands in for a module and imports the real one on first attribute access.
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+        # Per module and reentrant, so an import that touches another lazy module
+        # (or this one, through an import cycle) cannot deadlock on it.
+        self.__dict__["_lock"] = threading.RLock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    load_times[self.__name__] = time.perf_counter() - start
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,66 @@
+import os
+
+from crewai import LLM
+
+from utils import admission_utils, policy_utils
+from utils.trace_utils import span
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4.1-mini")
+
+
+def count_tokens(model, messages=None, text=None):
+    try:
+        import litellm
+        return litellm.token_counter(model=model, messages=messages, text=text)
+    except Exception:
+        # Roughly four characters per token for English text
+        chars = len(text or "") + sum(len(str(m.get("content", ""))) for m in messages or [])
+        return chars // 4 + 1
+
+
+class BudgetedLLM(LLM):
+    # Charges every request against the active run's token and call budget
+    # (see policy_utils.RunScope) and refuses it once the budget is spent.
+    # Requests also pass the process-wide admission controller: a concurrency
+    # slot and a token from the provider's rate limit (see admission_utils).
+
+    def call(self, messages, *args, **kwargs):
+        scope = policy_utils.current_scope()
+        if scope is not None and scope.overloaded is not None:
+            raise admission_utils.Overloaded(scope.overloaded)
+        prompt_tokens = count_tokens(self.model, messages=messages)
+        if scope is not None:
+            try:
+                scope.reserve(prompt_tokens)
+            except policy_utils.BudgetExceeded:
+                # A tool-loop request gets one last try as a forced final answer; structured
+                # (JSON-mode) requests have no final-answer form and fail as before.
+                if self.response_format is not None or not scope.grant_final():
+                    raise
+                messages = [*messages, {"role": "user", "content": policy_utils.FORCE_FINAL_PROMPT}]
+                prompt_tokens = count_tokens(self.model, messages=messages)
+        provider = admission_utils.provider_of(self.model)
+        controller = admission_utils.get_controller()
+        try:
+            with controller.llm_call(provider), span("llm.call", prompt_tokens=prompt_tokens) as record:
+                try:
+                    content = super().call(messages, *args, **kwargs)
+                except Exception as e:
+                    if admission_utils.is_rate_limit_error(e):
+                        controller.throttled(provider)
+                        raise admission_utils.Overloaded(f"{provider} is rate limiting requests") from e
+                    raise
+                completion_tokens = count_tokens(self.model, text=content or "")
+                record["attributes"]["completion_tokens"] = completion_tokens
+        except admission_utils.Overloaded as e:
+            if scope is not None:
+                scope.overloaded = str(e)
+            raise
+        if scope is not None:
+            scope.charge(prompt_tokens + completion_tokens)
+        return content
+
+
+def get_llm(**kwargs):
+    return BudgetedLLM(model=LLM_MODEL, api_key=os.getenv("OPENAI_API_KEY"),
+                       max_tokens=policy_utils.LLM_MAX_TOKENS, **kwargs)
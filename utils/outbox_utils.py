@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.email_utils import SMTP_HOST, SMTP_PORT, SMTP_SSL, build_message, connect_smtp, smtplib
+from utils.trace_utils import span
+
+OUTBOX_PATH = os.getenv("EMAIL_OUTBOX_PATH", "email_outbox.db")
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", "5"))
+# Close the SMTP connection after this many idle seconds; servers drop it anyway.
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "120"))
+# Seconds a worker owns a message it is sending; after that another worker may take it over.
+EMAIL_SEND_LEASE = float(os.getenv("EMAIL_SEND_LEASE", "300"))
+
+QUEUED, SENDING, RETRYING, SENT, FAILED = "queued", "sending", "retrying", "sent", "failed"
+
+
+class EmailOutbox:
+    # Durable outbox: messages are written to SQLite before enqueue() returns and
+    # delivered by one background worker that keeps its SMTP login open between
+    # messages. Failed sends are retried with exponential backoff.
+    # Several processes may share the database: a worker claims a message with a
+    # conditional update before sending it, and holds it for `lease` seconds, so
+    # only a message whose sender crashed is ever picked up again.
+
+    def __init__(self, path=OUTBOX_PATH, sender=None, password=None, host=SMTP_HOST, port=SMTP_PORT,
+                 use_ssl=SMTP_SSL, max_attempts=EMAIL_MAX_ATTEMPTS, retry_base=EMAIL_RETRY_BASE,
+                 idle_timeout=SMTP_IDLE_TIMEOUT, lease=EMAIL_SEND_LEASE):
+        self.sender = sender or os.getenv("EMAIL_ADDRESS")
+        self.password = password if password is not None else os.getenv("EMAIL_PASSWORD")
+        self.host, self.port, self.use_ssl = host, port, use_ssl
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.idle_timeout = idle_timeout
+        self.lease = lease
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._server = None
+        self._last_used = 0.0
+        self._worker = None
+        with self._db_lock:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id TEXT PRIMARY KEY, recipient TEXT, subject TEXT, body TEXT,
+                    status TEXT, attempts INTEGER DEFAULT 0, last_error TEXT,
+                    created_at REAL, next_attempt_at REAL, sent_at REAL, lease_until REAL
+                )""")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+            if "lease_until" not in columns:
+                self._db.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+            self._db.commit()
+        # Messages left over from an earlier process go out without waiting for a new one.
+        if self.pending_count():
+            self.start()
+
+    @property
+    def configured(self):
+        # A password is needed except for plain (SMTP_SSL=0) relays that accept mail without a login.
+        return bool(self.sender) and (bool(self.password) or not self.use_ssl)
+
+    def enqueue(self, recipient, subject, body):
+        message_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO outbox (id, recipient, subject, body, status, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (message_id, recipient, subject, body, QUEUED, now, now),
+            )
+            self._db.commit()
+        self.start()
+        self._wake.set()
+        return message_id
+
+    def status(self, message_id):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT status, attempts, last_error, next_attempt_at, sent_at FROM outbox WHERE id = ?", (message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("status", "attempts", "last_error", "next_attempt_at", "sent_at"), row))
+
+    def pending_count(self):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?, ?)", (QUEUED, RETRYING, SENDING)
+            ).fetchone()[0]
+
+    def start(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._loop, name="email-outbox", daemon=True)
+            self._worker.start()
+
+    def stop(self, wait=True):
+        self._stopping.set()
+        self._wake.set()
+        if wait and self._worker is not None:
+            self._worker.join()
+        self._disconnect()
+
+    def _next_due(self):
+        # Queued and retrying messages, and ones whose sender let the lease run out (e.g. it crashed).
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT id, recipient, subject, body, attempts, next_attempt_at, status FROM outbox "
+                "WHERE status IN (?, ?) OR (status = ? AND COALESCE(lease_until, 0) < ?) "
+                "ORDER BY next_attempt_at LIMIT 1", (QUEUED, RETRYING, SENDING, time.time())
+            ).fetchone()
+
+    def _claim(self, message_id, status, attempts):
+        # Takes the message only if no other worker changed it since it was read.
+        with self._db_lock:
+            cursor = self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, lease_until = ? WHERE id = ? AND status = ? AND attempts = ?",
+                (SENDING, attempts + 1, time.time() + self.lease, message_id, status, attempts),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            row = self._next_due()
+            now = time.time()
+            if row is None or row[5] > now:
+                timeout = self.idle_timeout if row is None else min(row[5] - now, self.idle_timeout)
+                self._wake.wait(timeout)
+                self._wake.clear()
+                if self._server is not None and time.time() - self._last_used >= self.idle_timeout:
+                    self._disconnect()
+                continue
+            if self._claim(row[0], row[6], row[4]):
+                self._deliver(*row[:5])
+        self._disconnect()
+
+    def _update(self, message_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock:
+            self._db.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), message_id))
+            self._db.commit()
+
+    def _connection(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except Exception:
+                pass
+            self._disconnect()
+        self._server = connect_smtp(self.sender, self.password, self.host, self.port, self.use_ssl)
+        return self._server
+
+    def _disconnect(self):
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+    def _deliver(self, message_id, recipient, subject, body, attempts):
+        # The message has been claimed, which counted this attempt.
+        attempts += 1
+        try:
+            with span("email.send", attempt=attempts):
+                msg = build_message(self.sender, recipient, subject, body)
+                self._connection().sendmail(self.sender, recipient, msg.as_string())
+            self._last_used = time.time()
+            self._update(message_id, status=SENT, sent_at=self._last_used, last_error=None)
+        except smtplib.SMTPRecipientsRefused as e:
+            self._update(message_id, status=FAILED, last_error=str(e))
+        except Exception as e:
+            self._disconnect()
+            if attempts >= self.max_attempts:
+                self._update(message_id, status=FAILED, last_error=str(e))
+            else:
+                delay = self.retry_base * 2 ** (attempts - 1)
+                self._update(message_id, status=RETRYING, last_error=str(e), next_attempt_at=time.time() + delay)
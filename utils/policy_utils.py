@@ -0,0 +1,151 @@
+import contextlib
+import contextvars
+import os
+import threading
+
+# Limits on how much work one diagnosis may trigger. A run is one upload's crews:
+# the diagnosis and recovery crews of a CrewRun share a single budget.
+AGENT_MAX_ITER = int(os.getenv("AGENT_MAX_ITER", "4"))
+AGENT_ALLOW_DELEGATION = os.getenv("AGENT_ALLOW_DELEGATION", "0") == "1"
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "0") == "1"
+# Prompts grow with every step of an agent's tool loop, since each request resends the
+# whole conversation. Measured: a crew that searches three times before answering
+# spends about 6,000 tokens, so both crews need ~12,000 before notes or answers run long.
+RUN_TOKEN_BUDGET = int(os.getenv("RUN_TOKEN_BUDGET", "24000"))
+RUN_MAX_LLM_CALLS = int(os.getenv("RUN_MAX_LLM_CALLS", "10"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1200"))
+# "crews" runs each agent's tool loop; "combined" answers diagnosis and recovery
+# with one retrieval and one structured LLM call.
+CREW_MODE = os.getenv("CREW_MODE", "crews")
+
+_current = contextvars.ContextVar("run_scope", default=None)
+
+
+# Appended to a crew's last request once the budget is spent, in place of further tool use
+FORCE_FINAL_PROMPT = ("You have used up the budget for this answer. Do not use any more tools: "
+                      "reply now with your best Final Answer based on what you already know.")
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def agent_settings():
+    return {"max_iter": AGENT_MAX_ITER, "allow_delegation": AGENT_ALLOW_DELEGATION, "verbose": AGENT_VERBOSE}
+
+
+class RunScope:
+    # Token and call accounting plus a memo of tool results for one run.
+    # Crews of the same run execute on different threads, hence the lock.
+
+    def __init__(self, token_budget=RUN_TOKEN_BUDGET, max_calls=RUN_MAX_LLM_CALLS):
+        self.token_budget = token_budget
+        self.max_calls = max_calls
+        self.tokens = 0
+        self.calls = 0
+        self.tool_calls = 0
+        self.tool_hits = 0
+        # Set once admission control turns the run away (see admission_utils); the
+        # agent's own retries then fail at once instead of queueing again.
+        self.overloaded = None
+        self._final = set()
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, prompt_tokens):
+        # Called before every LLM request; refuses it once the run is out of budget.
+        with self._lock:
+            if self.max_calls and self.calls >= self.max_calls:
+                raise BudgetExceeded(f"LLM call budget of {self.max_calls} calls used up")
+            if self.token_budget and self.tokens + prompt_tokens > self.token_budget:
+                raise BudgetExceeded(f"Token budget of {self.token_budget} tokens used up ({self.tokens} spent)")
+            self.calls += 1
+
+    def grant_final(self):
+        # Once the budget is spent each crew (one per thread) may still make one
+        # request, told to answer without tools, so it finishes instead of failing.
+        # The run can overshoot its budget by that last request per crew.
+        with self._lock:
+            crew = threading.get_ident()
+            if crew in self._final:
+                return False
+            self._final.add(crew)
+            self.calls += 1
+            return True
+
+    def charge(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+    def tool_result(self, name, args, call):
+        key = (name, _normalize(args))
+        with self._lock:
+            self.tool_calls += 1
+            future = self._tools.get(key)
+            if future is None:
+                future = self._tools[key] = _Result()
+                owner = True
+            else:
+                self.tool_hits += 1
+                owner = False
+        if owner:
+            try:
+                future.set(call())
+            except Exception as e:
+                future.fail(e)
+        return future.get()
+
+    def stats(self):
+        with self._lock:
+            return {"tokens": self.tokens, "llm_calls": self.calls,
+                    "tool_calls": self.tool_calls, "tool_hits": self.tool_hits}
+
+
+class _Result:
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set(self, value):
+        self._value = value
+        self._event.set()
+
+    def fail(self, error):
+        self._error = error
+        self._event.set()
+
+    def get(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def _normalize(args):
+    if isinstance(args, str):
+        return " ".join(args.lower().split())
+    if isinstance(args, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in args.items()))
+    return args
+
+
+def current_scope():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def activate(scope):
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+
+
+def dedup_tool_call(name, args, call):
+    # Identical tool calls within one run are answered once; outside a run they always execute.
+    scope = _current.get()
+    if scope is None:
+        return call()
+    return scope.tool_result(name, args, call)
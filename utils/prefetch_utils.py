@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.rate_limit_utils import TokenBucket
+from utils.trace_utils import TRACE_EXPORT_PATH, span
+from utils.weather_utils import (WEATHER_CACHE_TTL, WEATHER_PREFETCH_WINDOW, LookupCounts, get_weather_client,
+                                 normalize_location, weather_lookups)
+
+# Seconds between prefetch rounds; 0 leaves the scheduler off.
+WEATHER_PREFETCH_INTERVAL = float(os.getenv("WEATHER_PREFETCH_INTERVAL", "0"))
+# Most-requested locations kept warm, counted over WEATHER_PREFETCH_WINDOW
+WEATHER_PREFETCH_TOP = int(os.getenv("WEATHER_PREFETCH_TOP", "50"))
+# Always kept warm, whatever the logs say; separated by ";" since locations contain commas.
+WEATHER_PREFETCH_LOCATIONS = os.getenv("WEATHER_PREFETCH_LOCATIONS", "")
+WEATHER_FORECAST_DAYS = int(os.getenv("WEATHER_FORECAST_DAYS", "1"))
+# Provider calls per second the prefetcher may spend, and the burst it may take at once.
+# User-driven lookups are not counted against it, so leave them headroom under the plan's limit.
+# The budget is per process: N processes prefetching together spend up to N times this.
+WEATHER_RATE_LIMIT = float(os.getenv("WEATHER_RATE_LIMIT", "1"))
+WEATHER_RATE_BURST = int(os.getenv("WEATHER_RATE_BURST", "5"))
+# Entries older than this share of WEATHER_CACHE_TTL are refreshed, so they never expire under traffic.
+REFRESH_AT = 0.75
+
+
+class TraceLookups:
+    # Counts the `weather` spans (one per user lookup) in the trace export, so lookups
+    # made by other processes count too. Each update only reads what was appended since
+    # the last one; a file shorter than before is a new one and is read from the start.
+
+    def __init__(self, path=TRACE_EXPORT_PATH, window=WEATHER_PREFETCH_WINDOW):
+        self.path = path
+        self.counts = LookupCounts(window)
+        self._offset = 0
+
+    def update(self):
+        if not self.path or not os.path.exists(self.path):
+            return self.counts
+        if os.path.getsize(self.path) < self._offset:
+            self._offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                if b'"weather"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("name") == "weather":
+                    self.counts.add((record.get("attributes") or {}).get("location"), at=record.get("start") or 0)
+        return self.counts
+
+
+def configured_locations(value=WEATHER_PREFETCH_LOCATIONS):
+    return [normalize_location(part) for part in value.split(";") if normalize_location(part)]
+
+
+class WeatherPrefetcher:
+    # Keeps current conditions and short-range forecasts for the busiest locations
+    # in the weather cache, so peak-hour lookups are served without waiting on the
+    # provider. When current conditions are missing, get_weather answers from the
+    # prefetched forecast hour instead (see WeatherClient.forecast_hour).
+
+    def __init__(self, client=None, interval=WEATHER_PREFETCH_INTERVAL, top=WEATHER_PREFETCH_TOP,
+                 trace_path=TRACE_EXPORT_PATH, locations=None, forecast_days=WEATHER_FORECAST_DAYS,
+                 rate=WEATHER_RATE_LIMIT, burst=WEATHER_RATE_BURST, ttl=WEATHER_CACHE_TTL, workers=4, lookups=None):
+        self.client = client or get_weather_client()
+        self.interval = interval
+        self.top = top
+        self.lookups = weather_lookups if lookups is None else lookups
+        self.trace = TraceLookups(trace_path)
+        self.locations = configured_locations() if locations is None else [normalize_location(l) for l in locations]
+        self.forecast_days = forecast_days
+        self.ttl = ttl
+        self.workers = workers
+        self.limiter = TokenBucket(rate, burst)
+        self.stats = {"rounds": 0, "fetched": 0, "fresh": 0, "errors": 0, "locations": 0}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+
+    def targets(self):
+        # A lookup made here is also in the trace export, so each location takes the larger of the two counts
+        counts = Counter(dict(self.trace.update().most_common()))
+        for location, count in self.lookups.most_common():
+            counts[location] = max(counts[location], count)
+        locations = list(self.locations)
+        for location, _ in counts.most_common(self.top):
+            if location not in locations:
+                locations.append(location)
+        return locations
+
+    def _requests(self, location):
+        yield location, "current.json", {}
+        if self.forecast_days > 0:
+            yield location, "forecast.json", {"days": self.forecast_days}
+
+    def _due(self, age):
+        return age is None or age >= self.ttl * REFRESH_AT
+
+    def run_once(self):
+        locations = self.targets()
+        wanted = [request for location in locations for request in self._requests(location)]
+        due = [(location, endpoint, params) for location, endpoint, params in wanted
+               if self._due(self.client.age(location, endpoint, **params))]
+        counts = {"fetched": 0, "fresh": len(wanted) - len(due), "errors": 0}
+        with span("weather.prefetch", locations=len(locations), due=len(due)):
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="weather-prefetch") as pool:
+                futures = []
+                for location, endpoint, params in due:
+                    if not self.limiter.acquire(stop=self._stopping):
+                        break
+                    futures.append(pool.submit(self.client.refresh, location, endpoint, **params))
+                for future in futures:
+                    counts["errors" if "error" in future.result() else "fetched"] += 1
+        with self._lock:
+            self.stats["rounds"] += 1
+            self.stats["locations"] = len(locations)
+            for name, value in counts.items():
+                self.stats[name] += value
+        return counts
+
+    def start(self):
+        if self.interval <= 0:
+            return False
+        if self._worker is None or not self._worker.is_alive():
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._loop, name="weather-prefetcher", daemon=True)
+            self._worker.start()
+        return True
+
+    def stop(self, wait=True):
+        self._stopping.set()
+        if wait and self._worker is not None:
+            self._worker.join()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+            self._stopping.wait(self.interval)
+
+    def snapshot(self):
+        with self._lock:
+            return {"stats": dict(self.stats), "tokens": None if self.limiter.unlimited else self.limiter.available()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefetch weather for the most-requested locations.")
+    parser.add_argument("--trace", default=TRACE_EXPORT_PATH, help="trace JSONL to count location lookups in")
+    parser.add_argument("--top", type=int, default=WEATHER_PREFETCH_TOP)
+    parser.add_argument("--location", action="append", help="also prefetch this location (repeatable)")
+    parser.add_argument("--forecast-days", type=int, default=WEATHER_FORECAST_DAYS)
+    parser.add_argument("--rate", type=float, default=WEATHER_RATE_LIMIT, help="provider calls per second")
+    parser.add_argument("--fetch", action="store_true",
+                        help="run one round and print what it fetched (checks the key and rate limit; "
+                             "the cache it fills belongs to this process, so serving processes warm their own)")
+    args = parser.parse_args(argv)
+
+    locations = configured_locations() + [normalize_location(l) for l in args.location or []]
+    prefetcher = WeatherPrefetcher(trace_path=args.trace, top=args.top, locations=locations,
+                                   forecast_days=args.forecast_days, rate=args.rate)
+    if not args.fetch:
+        print("\n".join(prefetcher.targets()))
+        return
+    counts = prefetcher.run_once()
+    print(json.dumps(counts, indent=2))
+    if counts["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from utils import trace_utils
+
+# AGRIGPT_PROFILE=1 (or --profile on the command-line entry points) turns profiling on.
+PROFILE = os.getenv("AGRIGPT_PROFILE", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Seconds between stack samples of every thread
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+# Frames kept per allocation traceback. tracemalloc already makes imports several times
+# slower (CrewAI: ~8s -> ~45s) and each extra frame adds to that and to snapshot time.
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+# Minimum seconds between tracemalloc snapshots at checkpoints (e.g. Streamlit reruns);
+# with the model and crews loaded a snapshot takes several seconds.
+PROFILE_SNAPSHOT_INTERVAL = float(os.getenv("PROFILE_SNAPSHOT_INTERVAL", "120"))
+TOP_ALLOCATIONS = 25
+
+# Leaf frames of threads that are blocked rather than running; left out of the CPU profile.
+IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("thread.py", "_worker"), ("socketserver.py", "serve_forever"),
+    ("connection.py", "_poll"), ("connection.py", "_recv"),
+}
+_THREAD_SUFFIX = re.compile(r"[-_]\d+$")
+_MB = 1024 * 1024
+
+
+def rss_bytes():
+    # Resident set size right now; falls back to the peak where /proc is not available.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def stage_name(record):
+    resource = record["attributes"].get("resource")
+    return f"{record['name']}:{resource}" if resource else record["name"]
+
+
+class Profiler:
+    # Attributes memory and CPU time to the trace spans around each stage. For
+    # every span it records how traced Python allocations and RSS changed from
+    # start to end; a sampler thread collects the stacks of every thread, tagged
+    # with the stage the thread is in, as folded stacks for flamegraph tools.
+    # Memory deltas are process-wide, so stages overlapping on other threads blur
+    # each other: profile with one session at a time for clean numbers.
+
+    def __init__(self, output_dir=PROFILE_DIR, sample_interval=PROFILE_SAMPLE_INTERVAL,
+                 frames=PROFILE_TRACEMALLOC_FRAMES, snapshot_interval=PROFILE_SNAPSHOT_INTERVAL):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.frames = frames
+        self.snapshot_interval = snapshot_interval
+        self.started_at = None
+        self._open = {}
+        self._stages = {}
+        self._memory = {}
+        self._samples = Counter()
+        self._snapshots = 0
+        self._baseline = None
+        self._previous = None
+        self._last_snapshot = 0.0
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.started_at = time.time()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        trace_utils.add_listener(self)
+        self._stopping.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        self.checkpoint("start", force=True)
+
+    def stop(self):
+        trace_utils.remove_listener(self)
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.checkpoint("stop", force=True)
+
+    # --- trace_utils listener ---
+
+    def span_started(self, record):
+        traced = tracemalloc.get_traced_memory()[0]
+        rss = rss_bytes()
+        with self._lock:
+            self._open[record["span_id"]] = (traced, rss)
+            self._stages.setdefault(threading.get_ident(), []).append(stage_name(record))
+
+    def span_finished(self, record):
+        traced = tracemalloc.get_traced_memory()[0]
+        rss = rss_bytes()
+        stage = stage_name(record)
+        with self._lock:
+            start = self._open.pop(record["span_id"], None)
+            entry = self._memory.setdefault(stage, {
+                "count": 0, "total_ms": 0.0, "traced_delta": 0, "max_traced_delta": 0,
+                "rss_delta": 0, "max_rss_delta": 0, "max_rss": 0, "in_process": start is not None,
+            })
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"] or 0.0
+            if start is None:
+                # Timed elsewhere, e.g. in a renderer process (trace_utils.record_span)
+                return
+            stack = self._stages.get(threading.get_ident())
+            if stack:
+                stack.pop()
+            traced_delta = traced - start[0]
+            entry["traced_delta"] += traced_delta
+            entry["max_traced_delta"] = max(entry["max_traced_delta"], traced_delta)
+            if rss is not None and start[1] is not None:
+                entry["rss_delta"] += rss - start[1]
+                entry["max_rss_delta"] = max(entry["max_rss_delta"], rss - start[1])
+                entry["max_rss"] = max(entry["max_rss"], rss)
+
+    # --- CPU sampling ---
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stopping.wait(self.sample_interval):
+            frames = sys._current_frames()
+            names = {thread.ident: _THREAD_SUFFIX.sub("", thread.name) for thread in threading.enumerate()}
+            with self._lock:
+                stages = {ident: stack[-1] for ident, stack in self._stages.items() if stack}
+            folded = []
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                folded.append(";".join([stages.get(ident, "(no stage)"), names.get(ident, "thread"), *stack]))
+            with self._lock:
+                self._samples.update(folded)
+
+    # --- tracemalloc snapshots ---
+
+    def checkpoint(self, label, force=False):
+        # Snapshots allocations, writes how they grew since the first and the previous
+        # snapshot, and refreshes the reports. Called per Streamlit rerun, so growth
+        # between reruns shows up as a leak candidate.
+        if not tracemalloc.is_tracing():
+            return None
+        # Unforced checkpoints are skipped while another snapshot is being taken.
+        if not self._snapshot_lock.acquire(blocking=force):
+            return None
+        try:
+            now = time.monotonic()
+            if not force and now - self._last_snapshot < self.snapshot_interval:
+                return None
+            self._last_snapshot = now
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ])
+            self._snapshots += 1
+            safe_label = re.sub(r"[^\w.-]", "_", label)
+            path = os.path.join(self.output_dir, f"snapshot-{self._snapshots:03d}-{safe_label}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {label} at {time.strftime('%Y-%m-%d %H:%M:%S')}, "
+                        f"RSS {(rss_bytes() or 0) / _MB:.1f} MB, traced {tracemalloc.get_traced_memory()[0] / _MB:.1f} MB\n")
+                sections = [("largest allocation sites", snapshot.statistics("lineno"))]
+                if self._baseline is not None:
+                    sections.append(("growth since the first snapshot", snapshot.compare_to(self._baseline, "lineno")))
+                if self._previous is not None and self._previous is not self._baseline:
+                    sections.append(("growth since the previous snapshot", snapshot.compare_to(self._previous, "lineno")))
+                for title, stats in sections:
+                    f.write(f"\n## Top {TOP_ALLOCATIONS} {title}\n")
+                    for stat in stats[:TOP_ALLOCATIONS]:
+                        f.write(f"{stat}\n")
+            if self._baseline is None:
+                self._baseline = snapshot
+            self._previous = snapshot
+        finally:
+            self._snapshot_lock.release()
+        self.write()
+        return path
+
+    # --- reports ---
+
+    def memory_report(self):
+        with self._lock:
+            stages = {stage: dict(entry) for stage, entry in self._memory.items()}
+        traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {"started_at": self.started_at, "rss_bytes": rss_bytes(), "traced_bytes": traced,
+                "traced_peak_bytes": traced_peak, "stages": stages}
+
+    def write(self):
+        report = self.memory_report()
+        with open(os.path.join(self.output_dir, "memory.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.join(self.output_dir, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write(format_memory_report(report))
+        with self._lock:
+            samples = sorted(self._samples.items())
+        with open(os.path.join(self.output_dir, "cpu.folded"), "w", encoding="utf-8") as f:
+            for stack, count in samples:
+                f.write(f"{stack} {count}\n")
+
+
+def format_memory_report(report):
+    lines = [f"RSS {(report['rss_bytes'] or 0) / _MB:.1f} MB, traced Python allocations "
+             f"{report['traced_bytes'] / _MB:.1f} MB (peak {report['traced_peak_bytes'] / _MB:.1f} MB)", "",
+             f"{'stage':<36} {'count':>6} {'mean ms':>9} {'traced Δ MB':>12} {'max traced Δ':>13} "
+             f"{'RSS Δ MB':>9} {'max RSS Δ':>10} {'max RSS MB':>11}"]
+    stages = sorted(report["stages"].items(), key=lambda item: -max(item[1]["rss_delta"], item[1]["traced_delta"]))
+    for stage, entry in stages:
+        mean_ms = entry["total_ms"] / entry["count"] if entry["count"] else 0.0
+        if not entry["in_process"]:
+            lines.append(f"{stage:<36} {entry['count']:>6} {mean_ms:>9.1f} {'(out of process)':>12}")
+            continue
+        lines.append(f"{stage:<36} {entry['count']:>6} {mean_ms:>9.1f} {entry['traced_delta'] / _MB:>12.2f} "
+                     f"{entry['max_traced_delta'] / _MB:>13.2f} {entry['rss_delta'] / _MB:>9.2f} "
+                     f"{entry['max_rss_delta'] / _MB:>10.2f} {entry['max_rss'] / _MB:>11.1f}")
+    return "\n".join(lines) + "\n"
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def enable(output_dir=PROFILE_DIR, **kwargs):
+    # Idempotent, so Streamlit reruns keep the profiler that is already running.
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(output_dir, **kwargs)
+            _profiler.start()
+            atexit.register(disable)
+        return _profiler
+
+
+def disable():
+    global _profiler
+    with _profiler_lock:
+        profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+
+
+def checkpoint(label):
+    # Snapshots in the background, so a rerun or request is not held up by it.
+    profiler = _profiler
+    if profiler is not None:
+        threading.Thread(target=profiler.checkpoint, args=(label,), name="profiler-snapshot", daemon=True).start()
+
+
+def hot_frames(folded_path, limit=15):
+    # Per stage, from a cpu.folded file: (total samples, leaf functions with the most samples).
+    by_stage = defaultdict(Counter)
+    with open(folded_path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            frames = stack.split(";")
+            by_stage[frames[0]][frames[-1]] += int(count)
+    return {stage: (sum(counts.values()), counts.most_common(limit)) for stage, counts in by_stage.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a profiling run (see AGRIGPT_PROFILE).")
+    parser.add_argument("directory", nargs="?", default=PROFILE_DIR)
+    parser.add_argument("--top", type=int, default=10, help="hottest functions shown per stage")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.directory, "memory.json"), encoding="utf-8") as f:
+        print(format_memory_report(json.load(f)))
+    folded = os.path.join(args.directory, "cpu.folded")
+    if os.path.exists(folded):
+        hot = hot_frames(folded, args.top)
+        for stage, (total, frames) in sorted(hot.items(), key=lambda item: -item[1][0]):
+            print(f"\n{stage}: {total} samples")
+            for frame, count in frames:
+                print(f"  {count:>7}  {frame}")
+
+
+if __name__ == "__main__":
+    main()
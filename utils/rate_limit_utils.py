@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class TokenBucket:
+    # Allows `rate` calls per second on average and bursts of up to `capacity`.
+    # A rate of 0 or less means unlimited.
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        # Returns 0 if the tokens were taken, otherwise the seconds until they would be available.
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None, stop=None):
+        # Blocks until the tokens are taken. Gives up, returning False, after `timeout`
+        # seconds or as soon as the `stop` event is set.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def drain(self):
+        # Spends every token, e.g. after the remote side reported its own limit was hit.
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = 0.0
+
+    def available(self):
+        if self.unlimited:
+            return float("inf")
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
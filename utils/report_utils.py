@@ -0,0 +1,105 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from utils.trace_utils import record_span
+
+# Keep this module free of Streamlit: it is imported by the renderer processes.
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "128"))
+
+Report = namedtuple("Report", ["html", "pdf"])
+
+REPORT_TEMPLATE = """<html>
+<head>
+<meta charset="utf-8">
+<style>
+body {{ font-family: Helvetica, Arial, sans-serif; font-size: 11pt; line-height: 1.4; }}
+h1, h2, h3 {{ color: #7c3aed; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>"""
+
+
+def render_html(content):
+    # Crew answers are Markdown; the PDF and the email body share this HTML.
+    import markdown
+    return REPORT_TEMPLATE.format(body=markdown.markdown(str(content), extensions=["tables", "sane_lists"]))
+
+
+def html_to_pdf(html):
+    from xhtml2pdf import pisa
+    pdf_buffer = io.BytesIO()
+    pisa_status = pisa.CreatePDF(io.StringIO(html), dest=pdf_buffer)
+    if pisa_status.err:
+        raise RuntimeError("Failed to create PDF")
+    return pdf_buffer.getvalue()
+
+
+def _render(content):
+    html = render_html(content)
+    return Report(html, html_to_pdf(html))
+
+
+def _record(started, future):
+    # The render itself runs in another process; time it from here.
+    error = None if future.cancelled() or future.exception() is None else str(future.exception())
+    record_span("report.render", (time.perf_counter() - started) * 1000, error=error)
+
+
+class ReportRenderer:
+    # xhtml2pdf is pure Python and holds the GIL, so reports are rendered in
+    # worker processes. Finished reports are cached by a hash of their content
+    # and concurrent requests for the same content share one render.
+
+    def __init__(self, max_workers=REPORT_WORKERS, max_entries=REPORT_CACHE_SIZE):
+        self.max_entries = max_entries
+        # Forking a process that already runs TensorFlow and HTTP threads is unsafe.
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _key(self, content):
+        return hashlib.sha256(str(content).encode("utf-8")).hexdigest()
+
+    def submit(self, content):
+        key = self._key(content)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if key in self._inflight:
+                return self._inflight[key]
+            future = self._executor.submit(_render, str(content))
+            self._inflight[key] = future
+        started = time.perf_counter()
+        future.add_done_callback(lambda done: _record(started, done))
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def render(self, content, timeout=None):
+        return self.submit(content).result(timeout=timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
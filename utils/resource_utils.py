@@ -0,0 +1,212 @@
+import threading
+
+from utils.trace_utils import span
+
+_factories = {}
+_teardowns = {}
+_instances = {}
+_dependents = {}
+_locks = {}
+_lock = threading.RLock()
+_building = threading.local()
+
+
+def register(name, factory, teardown=None):
+    with _lock:
+        invalidate(name)
+        _factories[name] = factory
+        _teardowns[name] = teardown
+
+
+def is_loaded(name):
+    return name in _instances
+
+
+def get(name):
+    stack = getattr(_building, "stack", None)
+    if stack is None:
+        stack = _building.stack = []
+    with _lock:
+        if name not in _factories:
+            raise KeyError(f"Unknown resource: {name}")
+        if stack:
+            # Whatever is being built right now depends on `name`.
+            _dependents.setdefault(name, set()).add(stack[-1])
+        if name in _instances:
+            return _instances[name]
+        name_lock = _locks.setdefault(name, threading.RLock())
+    with name_lock:
+        if name in _instances:
+            return _instances[name]
+        stack.append(name)
+        try:
+            with span("resource.build", resource=name):
+                instance = _factories[name]()
+        finally:
+            stack.pop()
+        with _lock:
+            _instances[name] = instance
+        return instance
+
+
+def warm_up(*names):
+    for name in names or list(_factories):
+        get(name)
+
+
+def _warm_up_quietly(names):
+    # Failures are left for the foreground get() to raise and report.
+    for name in names or list(_factories):
+        try:
+            get(name)
+        except Exception:
+            pass
+
+
+def warm_up_async(*names):
+    thread = threading.Thread(target=_warm_up_quietly, args=(names,), name="resource-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def invalidate(name=None):
+    with _lock:
+        if name is None:
+            for loaded in list(_instances):
+                invalidate(loaded)
+            return
+        for dependent in _dependents.pop(name, ()):
+            invalidate(dependent)
+        if name not in _instances:
+            return
+        instance = _instances.pop(name)
+        teardown = _teardowns.get(name)
+    if teardown:
+        teardown(instance)
+
+
+# --- AgriGPT resources ---
+
+def _pathogen_model():
+    from utils.inference_utils import load_pathogen_model
+    return load_pathogen_model()
+
+
+def _classifier():
+    from utils.inference_utils import BatchClassifier
+    return BatchClassifier(get("pathogen_model"))
+
+
+def _embeddings():
+    from utils.astra_db_utils import get_embeddings
+    from utils.embedding_utils import CachedEmbeddings
+    return CachedEmbeddings(get_embeddings())
+
+
+def _vectorstore():
+    from utils.vector_store_utils import get_vectorstore
+    return get_vectorstore(embedding=get("embeddings"))
+
+
+def _response_store():
+    from utils.vector_store_utils import RESPONSE_CACHE_COLLECTION, get_vectorstore
+    return get_vectorstore(embedding=get("embeddings"), collection=RESPONSE_CACHE_COLLECTION)
+
+
+def _knowledge_tool():
+    from tools.astra_search_tool import AstraSearchTool
+    return AstraSearchTool(vectorstore=get("vectorstore"))
+
+
+def _response_cache():
+    from utils.cache_utils import ResponseCache
+    return ResponseCache(embeddings=get("embeddings"), vectorstore=get("response_store"))
+
+
+def _advice_index():
+    from utils.advice_utils import AdviceIndex
+    return AdviceIndex.load()
+
+
+def _result_store():
+    from utils.history_utils import ResultStore
+    return ResultStore()
+
+
+def _email_outbox():
+    from utils.outbox_utils import EmailOutbox
+    return EmailOutbox()
+
+
+def _report_renderer():
+    from utils.report_utils import ReportRenderer
+    return ReportRenderer()
+
+
+def _weather_prefetcher():
+    from utils.prefetch_utils import WeatherPrefetcher
+    return WeatherPrefetcher()
+
+
+def _admission_controller():
+    from utils.admission_utils import AdmissionController
+    return AdmissionController()
+
+
+def _diagnosis_service():
+    from services.diagnosis_service import DiagnosisService
+    return DiagnosisService()
+
+
+def _llm():
+    from utils.llm_utils import get_llm
+    return get_llm()
+
+
+def _combined_llm():
+    from utils.llm_utils import get_llm
+    return get_llm(response_format={"type": "json_object"})
+
+
+def _agriculture_agent():
+    from agents.agriculture_agent import get_agriculture_agent
+    from utils.policy_utils import agent_settings
+    return get_agriculture_agent(get("knowledge_tool"), get("llm"), **agent_settings())
+
+
+def _recovery_agent():
+    from agents.recovery_agent import get_recovery_agent
+    from utils.policy_utils import agent_settings
+    return get_recovery_agent(get("knowledge_tool"), get("llm"), **agent_settings())
+
+
+def _diagnosis_task():
+    from tasks.diagnosis_task import get_diagnosis_task
+    return get_diagnosis_task(get("knowledge_tool"), get("agriculture_agent"))
+
+
+def _recovery_task():
+    from tasks.recovery_task import get_recovery_task
+    return get_recovery_task(get("knowledge_tool"), get("recovery_agent"))
+
+
+register("pathogen_model", _pathogen_model)
+register("classifier", _classifier, teardown=lambda classifier: classifier.close())
+register("embeddings", _embeddings, teardown=lambda embeddings: embeddings.close())
+register("vectorstore", _vectorstore)
+register("response_store", _response_store)
+register("response_cache", _response_cache)
+register("advice_index", _advice_index)
+register("knowledge_tool", _knowledge_tool)
+register("result_store", _result_store, teardown=lambda store: store.close())
+register("email_outbox", _email_outbox, teardown=lambda outbox: outbox.stop())
+register("report_renderer", _report_renderer, teardown=lambda renderer: renderer.close())
+register("weather_prefetcher", _weather_prefetcher, teardown=lambda prefetcher: prefetcher.stop())
+register("admission_controller", _admission_controller)
+register("diagnosis_service", _diagnosis_service)
+register("llm", _llm)
+register("combined_llm", _combined_llm)
+register("agriculture_agent", _agriculture_agent)
+register("recovery_agent", _recovery_agent)
+register("diagnosis_task", _diagnosis_task)
+register("recovery_task", _recovery_task)
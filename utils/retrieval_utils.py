@@ -0,0 +1,239 @@
+import contextlib
+import contextvars
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from utils.cache_utils import normalize_text
+
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+# Candidates gathered from each of the vector and keyword indexes before fusion and MMR
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+# 1.0 ranks purely by relevance; lower values trade relevance for diversity
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+# Share of the fused score that comes from BM25 keyword matches (0 disables the keyword index)
+RETRIEVAL_KEYWORD_WEIGHT = float(os.getenv("RETRIEVAL_KEYWORD_WEIGHT", "0.3"))
+RRF_K = 60
+# On remote stores, a filter (e.g. this class + crop + language) that has matched nothing
+# on this many searches, and never matched anything, is skipped, saving a round trip per search, until
+# RETRIEVAL_FILTER_RECHECK seconds have passed. Knowledge bases loaded before documents carried
+# these metadata fields never match them.
+FILTER_PROBES = 3
+RETRIEVAL_FILTER_RECHECK = float(os.getenv("RETRIEVAL_FILTER_RECHECK", "600"))
+
+FILTER_FIELDS = ("predicted_class", "name", "language")
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+_filters = contextvars.ContextVar("retrieval_filters", default=None)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(str(text).lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+def filters_for(inputs):
+    # Metadata a crew's inputs pin down: pathogen class, crop and language.
+    filters = {field: normalize_text(inputs.get(field)) for field in FILTER_FIELDS}
+    return {field: value for field, value in filters.items() if value}
+
+
+def current_filters():
+    return _filters.get() or {}
+
+
+@contextlib.contextmanager
+def retrieval_filters(**filters):
+    token = _filters.set({field: value for field, value in filters.items() if value})
+    try:
+        yield
+    finally:
+        _filters.reset(token)
+
+
+class KeywordIndex:
+    # Append-only BM25 index over row numbers. Postings are packed arrays, so
+    # 100k short documents cost tens of megabytes rather than hundreds.
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = array("I")
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, texts):
+        with self._lock:
+            for text in texts:
+                row = len(self._lengths)
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._total_length += length
+                for token, tf in counts.items():
+                    posting = self._postings.get(token)
+                    if posting is None:
+                        posting = self._postings[token] = (array("I"), array("H"))
+                    posting[0].append(row)
+                    posting[1].append(min(tf, 65535))
+
+    def search(self, query, k, rows=None):
+        # Returns (rows, scores) of the best `k` matches, restricted to `rows` if given.
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            average = self._total_length / n or 1.0
+            scores = np.zeros(n, dtype=np.float32)
+            for token in set(tokenize(query)):
+                posting = self._postings.get(token)
+                if posting is None:
+                    continue
+                hits = np.frombuffer(posting[0], dtype=np.uint32).astype(np.int64)
+                tf = np.frombuffer(posting[1], dtype=np.uint16).astype(np.float32)
+                idf = math.log(1 + (n - len(hits) + 0.5) / (len(hits) + 0.5))
+                scores[hits] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths[hits] / average))
+        candidates = np.arange(n) if rows is None else rows
+        return top_k(candidates, scores[candidates], k, positive=True)
+
+
+def top_k(rows, scores, k, positive=False):
+    keep = scores > 0 if positive else np.isfinite(scores)
+    rows, scores = rows[keep], scores[keep]
+    if len(rows) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
+
+
+def reciprocal_rank_fusion(rankings, weights, k=RRF_K):
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, row in enumerate(ranking):
+            fused[int(row)] = fused.get(int(row), 0.0) + weight / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def mmr(vectors, relevance, k, lambda_mult=RETRIEVAL_MMR_LAMBDA):
+    # Maximal marginal relevance over normalized candidate vectors; returns candidate positions.
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    if len(relevance) and relevance.max() > 0:
+        relevance = relevance / relevance.max()
+    selected = []
+    redundancy = np.full(len(relevance), -np.inf, dtype=np.float32)
+    while len(selected) < min(k, len(relevance)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.maximum(redundancy, 0)
+        if selected:
+            scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+def _filter_key(filter):
+    # Per value, so a crop or class missing from the store never suppresses the ones it has
+    return tuple(sorted((key, str(value)) for key, value in filter.items()))
+
+
+class Retriever:
+    # Search over the knowledge base with metadata prefiltering, BM25 + vector
+    # fusion and MMR. The local store supports all three; any other langchain
+    # vectorstore gets its own filtered MMR or similarity search.
+
+    def __init__(self, vectorstore, k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K,
+                 mmr_lambda=RETRIEVAL_MMR_LAMBDA, keyword_weight=RETRIEVAL_KEYWORD_WEIGHT):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.keyword_weight = keyword_weight
+        # Filter (field, value) items -> {"hits", "misses", "since"}, for remote stores only
+        self._filter_stats = {}
+        self._lock = threading.Lock()
+
+    def search(self, query, k=None, filter=None):
+        # Too few matches under the full filter relax it to the pathogen class, then to nothing.
+        k = k or self.k
+        filter = dict(filter or {})
+        attempts = [filter]
+        if len(filter) > 1 and "predicted_class" in filter:
+            attempts.append({"predicted_class": filter["predicted_class"]})
+        if filter:
+            attempts.append({})
+        remote = not hasattr(self.vectorstore, "keyword_search")
+        documents, seen = [], set()
+        for attempt in attempts:
+            if attempt and remote and self._skip(attempt):
+                continue
+            found = self._search(query, k, attempt)
+            if attempt and remote:
+                self._record(attempt, bool(found))
+            for doc in found:
+                if doc.page_content not in seen:
+                    seen.add(doc.page_content)
+                    documents.append(doc)
+            if len(documents) >= k:
+                break
+        return documents[:k]
+
+    def _skip(self, filter):
+        with self._lock:
+            stats = self._filter_stats.get(_filter_key(filter))
+            return (stats is not None and not stats["hits"] and stats["misses"] >= FILTER_PROBES
+                    and time.monotonic() - stats["since"] < RETRIEVAL_FILTER_RECHECK)
+
+    def _record(self, filter, found):
+        now = time.monotonic()
+        with self._lock:
+            stats = self._filter_stats.get(_filter_key(filter))
+            if stats is None or now - stats["since"] >= RETRIEVAL_FILTER_RECHECK:
+                stats = self._filter_stats[_filter_key(filter)] = {"hits": 0, "misses": 0, "since": now}
+            stats["hits" if found else "misses"] += 1
+
+    def _search(self, query, k, filter):
+        store = self.vectorstore
+        if hasattr(store, "keyword_search"):
+            return self._hybrid_search(query, k, filter)
+        if self.mmr_lambda < 1 and hasattr(store, "max_marginal_relevance_search"):
+            return store.max_marginal_relevance_search(query, k=k, fetch_k=self.fetch_k,
+                                                       lambda_mult=self.mmr_lambda, filter=filter or None)
+        return store.similarity_search(query, k=k, filter=filter or None)
+
+    def _hybrid_search(self, query, k, filter):
+        store = self.vectorstore
+        if not len(store):
+            return []
+        rows = store.filter_rows(filter) if filter else None
+        if rows is not None and not len(rows):
+            return []
+        fetch_k = max(self.fetch_k, k)
+        vector = store.embedding.embed_query(query)
+        rankings, weights = [store.vector_search(vector, fetch_k, rows)[0]], [1 - self.keyword_weight]
+        if self.keyword_weight > 0:
+            rankings.append(store.keyword_search(query, fetch_k, rows)[0])
+            weights.append(self.keyword_weight)
+        fused = reciprocal_rank_fusion(rankings, weights)[:fetch_k]
+        if not fused:
+            return []
+        candidates = np.asarray([row for row, _ in fused], dtype=np.int64)
+        if self.mmr_lambda < 1:
+            order = mmr(store.vectors(candidates), [score for _, score in fused], k, self.mmr_lambda)
+            candidates = candidates[order]
+        return store.documents(candidates[:k])
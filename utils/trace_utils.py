@@ -0,0 +1,164 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+# Durations kept per stage for the percentiles
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "2048"))
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=TRACE_HISTORY))
+_counts = defaultdict(int)
+_errors = defaultdict(int)
+_recent = deque(maxlen=200)
+# Objects with span_started(record) and span_finished(record) methods, e.g. the profiler
+_listeners = []
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_span():
+    return _current.get()
+
+
+def add_listener(listener):
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _notify(method, record):
+    # Listeners must not break the work being traced.
+    for listener in list(_listeners):
+        try:
+            getattr(listener, method)(record)
+        except Exception:
+            pass
+
+
+def _finish(record):
+    if _listeners:
+        _notify("span_finished", record)
+    name = record["name"]
+    with _lock:
+        _durations[name].append(record["duration_ms"])
+        _counts[name] += 1
+        if record.get("error"):
+            _errors[name] += 1
+        _recent.append(record)
+        if TRACE_EXPORT_PATH:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def span(name, **attributes):
+    parent = _current.get()
+    record = {
+        "trace_id": parent["trace_id"] if parent else _new_id(),
+        "span_id": _new_id(),
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "duration_ms": None,
+        "attributes": attributes,
+        "error": None,
+    }
+    token = _current.set(record)
+    if _listeners:
+        _notify("span_started", record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        _current.reset(token)
+        _finish(record)
+
+
+def record_span(name, duration_ms, error=None, **attributes):
+    # For work timed elsewhere, e.g. in another process.
+    parent = _current.get()
+    _finish({
+        "trace_id": parent["trace_id"] if parent else _new_id(),
+        "span_id": _new_id(),
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time() - duration_ms / 1000,
+        "duration_ms": duration_ms,
+        "attributes": attributes,
+        "error": error,
+    })
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stats():
+    with _lock:
+        samples = {name: np.fromiter(durations, dtype=float) for name, durations in _durations.items()}
+        counts = dict(_counts)
+        errors = dict(_errors)
+    summary = {}
+    for name, values in sorted(samples.items()):
+        if not len(values):
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary[name] = {
+            "count": counts[name],
+            "errors": errors.get(name, 0),
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(values.max()),
+        }
+    return summary
+
+
+def recent_spans(limit=50):
+    with _lock:
+        return list(_recent)[-limit:]
+
+
+def export_jsonl(path, spans=None):
+    spans = recent_spans(len(_recent)) if spans is None else spans
+    with open(path, "a", encoding="utf-8") as f:
+        for record in spans:
+            f.write(json.dumps(record, default=str) + "\n")
+    return len(spans)
+
+
+def reset():
+    with _lock:
+        _durations.clear()
+        _counts.clear()
+        _errors.clear()
+        _recent.clear()
@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import threading
+import uuid
+from array import array
+
+import numpy as np
+
+from utils.astra_db_utils import get_astra_vectorstore, get_embeddings
+from utils.lazy_utils import lazy_import
+from utils.retrieval_utils import KeywordIndex, top_k
+
+langchain_docstore = lazy_import("langchain.docstore.document")
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "astra")
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "vector_store")
+# Cached crew answers live apart from the knowledge base, so the agents never retrieve their own output:
+# an Astra table of this name, or a directory of this name inside LOCAL_VECTOR_STORE_PATH.
+RESPONSE_CACHE_COLLECTION = os.getenv("RESPONSE_CACHE_COLLECTION", "plant_response_cache")
+
+
+def _normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _matches(metadata, filter):
+    return all(metadata.get(key) == value for key, value in filter.items())
+
+
+def _indexable(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+class LocalVectorStore:
+    # In-process drop-in for the Cassandra vectorstore: it implements the same
+    # add_documents / add_texts / similarity_search(filter=...) calls that
+    # utils.astra_db_utils makes.
+    #
+    # Layout on disk:
+    #   embeddings.f32   row-major float32 matrix of normalized embeddings, memory-mapped
+    #   documents.jsonl  one {"id", "page_content", "metadata"} line per row
+    #   meta.json        {"dim": ...}
+    # Both data files are append-only, so adding documents never rewrites the store.
+    # The metadata and BM25 keyword indexes are rebuilt in memory on first use.
+
+    def __init__(self, path=LOCAL_VECTOR_STORE_PATH, embedding=None):
+        self.path = path
+        self.embedding = embedding
+        self._lock = threading.RLock()
+        self._matrix = None
+        os.makedirs(path, exist_ok=True)
+        self.dim = self._read_meta().get("dim")
+        self._records = self._read_records()
+        self._metadata_postings = {}
+        self._metadata_rows = 0
+        self._keywords = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _read_records(self):
+        # A crash between the two appends (or halfway through one) leaves the files out
+        # of step. Both are cut back to the rows they have in common, on disk as well,
+        # since later appends would otherwise pair documents with the wrong embeddings.
+        records, ends = [], []
+        documents_path, matrix_path = self._file("documents.jsonl"), self._file("embeddings.f32")
+        try:
+            with open(documents_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    if line.strip():
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            break
+                        ends.append(offset)
+        except FileNotFoundError:
+            pass
+        if not self.dim:
+            return records
+        row_bytes = 4 * self.dim
+        rows = min(len(records), os.path.getsize(matrix_path) // row_bytes if os.path.exists(matrix_path) else 0)
+        records = records[:rows]
+        if os.path.exists(documents_path) and os.path.getsize(documents_path) != (ends[rows - 1] if rows else 0):
+            os.truncate(documents_path, ends[rows - 1] if rows else 0)
+        if os.path.exists(matrix_path) and os.path.getsize(matrix_path) != rows * row_bytes:
+            os.truncate(matrix_path, rows * row_bytes)
+        return records
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def matrix(self):
+        with self._lock:
+            if self._matrix is None or len(self._matrix) != len(self._records):
+                if not self._records:
+                    return np.empty((0, self.dim or 0), dtype=np.float32)
+                self._matrix = np.memmap(self._file("embeddings.f32"), dtype=np.float32, mode="r",
+                                         shape=(len(self._records), self.dim))
+            return self._matrix
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        vectors = _normalize(vectors)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match store size {self.dim}")
+            records = [
+                {"id": doc_id, "page_content": text, "metadata": metadata or {}}
+                for doc_id, text, metadata in zip(ids, texts, metadatas)
+            ]
+            with open(self._file("embeddings.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._file("documents.jsonl"), "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            self._records.extend(records)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def add_documents(self, documents, **kwargs):
+        return self.add_texts([d.page_content for d in documents], [d.metadata for d in documents], **kwargs)
+
+    def filter_rows(self, filter):
+        # Row numbers whose metadata equals every filter value, from an inverted index
+        # rather than a scan over every record.
+        with self._lock:
+            matrix = self.matrix
+            records = self._records[:len(matrix)]
+            if not all(_indexable(value) for value in filter.values()):
+                return np.flatnonzero([_matches(r["metadata"], filter) for r in records])
+            for row in range(self._metadata_rows, len(records)):
+                for key, value in records[row]["metadata"].items():
+                    if _indexable(value):
+                        self._metadata_postings.setdefault((key, value), array("I")).append(row)
+            self._metadata_rows = len(records)
+            rows = None
+            for key, value in filter.items():
+                posting = self._metadata_postings.get((key, value))
+                if posting is None:
+                    return np.empty(0, dtype=np.int64)
+                posting = np.frombuffer(posting, dtype=np.uint32).astype(np.int64)
+                rows = posting if rows is None else np.intersect1d(rows, posting, assume_unique=True)
+            return rows
+
+    def vector_search(self, vector, k, rows=None):
+        # (rows, cosine scores) of the `k` nearest rows, optionally only among `rows`.
+        matrix = self.matrix
+        if rows is None:
+            rows = np.arange(len(matrix))
+            scores = matrix @ _normalize(vector)[0]
+        else:
+            scores = matrix[rows] @ _normalize(vector)[0]
+        return top_k(rows, scores, k)
+
+    def keyword_search(self, query, k, rows=None):
+        with self._lock:
+            matrix = self.matrix
+            if self._keywords is None:
+                self._keywords = KeywordIndex()
+            indexed = len(self._keywords)
+            if indexed < len(matrix):
+                self._keywords.add(r["page_content"] for r in self._records[indexed:len(matrix)])
+        return self._keywords.search(query, k, rows)
+
+    def vectors(self, rows):
+        return np.asarray(self.matrix[rows])
+
+    def documents(self, rows, scores=None):
+        with self._lock:
+            records = [self._records[int(row)] for row in rows]
+        documents = [langchain_docstore.Document(page_content=r["page_content"], metadata=r["metadata"]) for r in records]
+        return documents if scores is None else list(zip(documents, (float(s) for s in scores)))
+
+    def similarity_search_by_vector_with_score(self, vector, k=4, filter=None):
+        if not len(self):
+            return []
+        rows = self.filter_rows(filter) if filter else None
+        if rows is not None and not len(rows):
+            return []
+        rows, scores = self.vector_search(vector, k, rows)
+        return self.documents(rows, scores)
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        from utils.retrieval_utils import mmr
+        rows = self.filter_rows(filter) if filter else None
+        if not len(self) or (rows is not None and not len(rows)):
+            return []
+        rows, scores = self.vector_search(self.embedding.embed_query(query), max(fetch_k, k), rows)
+        return self.documents(rows[mmr(self.vectors(rows), scores, k, lambda_mult)])
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def iter_records(self):
+        with self._lock:
+            matrix = self.matrix
+            records = self._records[:len(matrix)]
+        for record, vector in zip(records, matrix):
+            yield record, np.asarray(vector)
+
+
+def get_local_vectorstore(embedding=None, path=LOCAL_VECTOR_STORE_PATH):
+    return LocalVectorStore(path, embedding=embedding or get_embeddings())
+
+
+def get_vectorstore(embedding=None, backend=VECTOR_BACKEND, collection=None):
+    # `collection` picks a store other than the knowledge base, e.g. RESPONSE_CACHE_COLLECTION.
+    if backend == "local":
+        path = os.path.join(LOCAL_VECTOR_STORE_PATH, collection) if collection else LOCAL_VECTOR_STORE_PATH
+        return get_local_vectorstore(embedding, path)
+    if collection:
+        return get_astra_vectorstore(embedding, table_name=collection)
+    return get_astra_vectorstore(embedding)
+
+
+def pull_from_astra(astra_store, local_store, batch_size=500):
+    # Copies every Astra row, embeddings included, so nothing is re-encoded.
+    rows = astra_store.table.find_entries(n=1_000_000_000)
+    known = {r["id"] for r in local_store._records}
+    batch = []
+    copied = 0
+    for row in rows:
+        if row["row_id"] in known:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            copied += _add_rows(local_store, batch)
+            batch = []
+    if batch:
+        copied += _add_rows(local_store, batch)
+    return copied
+
+
+def _add_rows(local_store, rows):
+    local_store.add_embeddings(
+        [row["body_blob"] for row in rows],
+        [row["vector"] for row in rows],
+        [dict(row.get("metadata") or {}) for row in rows],
+        [row["row_id"] for row in rows],
+    )
+    return len(rows)
+
+
+def push_to_astra(local_store, astra_store, batch_size=100):
+    # Writes the stored embeddings straight to the table, as Cassandra.add_texts does once
+    # it has embedded the texts, so nothing is run through the encoder again.
+    batch = []
+    pushed = 0
+    for record, vector in local_store.iter_records():
+        batch.append((record, vector))
+        if len(batch) >= batch_size:
+            pushed += _put_rows(astra_store, batch)
+            batch = []
+    if batch:
+        pushed += _put_rows(astra_store, batch)
+    return pushed
+
+
+def _put_rows(astra_store, rows):
+    futures = [
+        astra_store.table.put_async(row_id=record["id"], body_blob=record["page_content"],
+                                    vector=vector.tolist(), metadata=record["metadata"] or {})
+        for record, vector in rows
+    ]
+    for future in futures:
+        future.result()
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync the local vector store with Astra DB.")
+    parser.add_argument("direction", choices=["pull", "push"], help="pull: Astra -> local, push: local -> Astra")
+    parser.add_argument("--path", default=LOCAL_VECTOR_STORE_PATH)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    embedding = get_embeddings()
+    astra_store = get_astra_vectorstore(embedding)
+    if astra_store is None:
+        raise SystemExit("Astra DB credentials are missing.")
+    local_store = LocalVectorStore(args.path, embedding=embedding)
+    if args.direction == "pull":
+        print(f"Copied {pull_from_astra(astra_store, local_store)} documents into {args.path}")
+    else:
+        print(f"Uploaded {push_to_astra(local_store, astra_store)} documents to Astra DB")
+
+
+if __name__ == "__main__":
+    main()
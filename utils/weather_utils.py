@@ -1,19 +1,306 @@
 import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.trace_utils import span
+
+WEATHER_API_URL = "http://api.weatherapi.com/v1"
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "10"))
+# Current conditions are only updated every 15 minutes by the provider.
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+# Older answers are still served, and refreshed in the background, up to this age.
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "3600"))
+# Answers kept per process (least recently used are evicted)
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+# Lookups per location are counted over this many seconds, to pick the locations worth prefetching.
+WEATHER_PREFETCH_WINDOW = float(os.getenv("WEATHER_PREFETCH_WINDOW", str(7 * 86400)))
+
+
+def normalize_location(location):
+    parts = [" ".join(part.split()) for part in str(location or "").lower().split(",")]
+    return ",".join(part for part in parts if part)
+
+
+class WeatherApiProvider:
+    def __init__(self, api_key=None, timeout=WEATHER_TIMEOUT, pool_size=20):
+        self.api_key = api_key or os.getenv("WEATHER_API_KEY")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, location, endpoint="current.json", **params):
+        if not self.api_key:
+            return {"error": "Weather API key not configured"}
+        try:
+            response = self.session.get(
+                f"{WEATHER_API_URL}/{endpoint}",
+                params={"key": self.api_key, "q": location, "aqi": "no", **params},
+                timeout=self.timeout,
+            )
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return {"error": f"Unable to fetch data: {response.status_code} - {response.text}"}
+        except requests.exceptions.RequestException as e:
+            return {"error": f"Network error: {e}"}
+        except Exception as e:
+            return {"error": f"Unexpected error: {e}"}
+
+
+class FakeWeatherProvider:
+    # Offline stand-in returning weatherapi.com-shaped payloads.
+    def __init__(self, current=None, latency=0.0):
+        self.current = current or {
+            "temp_c": 24.0, "feelslike_c": 25.1, "humidity": 70, "uv": 5.0,
+            "wind_kph": 11.2, "wind_dir": "SW", "condition": {"text": "Partly cloudy"},
+        }
+        self.latency = latency
+        self.calls = 0
+
+    def fetch(self, location, endpoint="current.json", **params):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        name, _, country = str(location).partition(",")
+        now = int(time.time())
+        data = {
+            "location": {"name": name.strip().title(), "country": country.strip().title() or "Unknown", "localtime_epoch": now},
+            "current": {**self.current, "last_updated_epoch": now},
+        }
+        if endpoint == "forecast.json":
+            days = int(params.get("days", 1))
+            data["forecast"] = {"forecastday": [
+                {"date_epoch": now + 86400 * i, "day": {
+                    "maxtemp_c": self.current["temp_c"] + 3, "mintemp_c": self.current["temp_c"] - 5,
+                    "avghumidity": self.current["humidity"], "condition": self.current["condition"],
+                    "maxwind_kph": self.current["wind_kph"], "uv": self.current["uv"],
+                }, "hour": [
+                    {**self.current, "time_epoch": now // 3600 * 3600 + 86400 * i + 3600 * h} for h in range(24)
+                ]} for i in range(days)
+            ]}
+        return data
+
+
+class WeatherClient:
+    # Caches provider answers per normalized location, serves stale entries
+    # while refreshing them in the background, and lets concurrent lookups of
+    # the same location share a single provider call. Errors are never cached.
+    # The cache is an LRU of `max_entries`; entries past the stale TTL are dropped.
+
+    def __init__(self, provider, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_STALE_TTL, max_entries=WEATHER_CACHE_SIZE):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _key(self, location, endpoint, params):
+        return (endpoint, normalize_location(location), tuple(sorted(params.items())))
+
+    def _lookup(self, key):
+        # The cached (fetched_at, data) entry, or None if missing or past the stale TTL. Call under the lock.
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.stale_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        # Call under the lock.
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_entries:
+            expired = time.time() - self.stale_ttl
+            for old in [k for k, (fetched_at, _) in self._cache.items() if fetched_at <= expired]:
+                del self._cache[old]
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def get(self, location, endpoint="current.json", **params):
+        key = self._key(location, endpoint, params)
+        with self._lock:
+            entry = self._lookup(key)
+        if entry:
+            if time.time() - entry[0] < self.ttl:
+                return entry[1]
+            self._fetch(key, location, endpoint, params, wait=False)
+            return entry[1]
+        return self._fetch(key, location, endpoint, params)
+
+    def age(self, location, endpoint="current.json", **params):
+        # Seconds since this answer was cached, or None if it is not (or no longer usable).
+        with self._lock:
+            entry = self._lookup(self._key(location, endpoint, params))
+        return None if entry is None else time.time() - entry[0]
+
+    def refresh(self, location, endpoint="current.json", wait=True, **params):
+        # Fetches now whatever the cached copy's age; joins a fetch already in flight.
+        return self._fetch(self._key(location, endpoint, params), location, endpoint, params, wait=wait)
+
+    def forecast_hour(self, location, at=None):
+        # The cached forecast hour covering `at` (default now), shaped like a current-conditions
+        # answer, or None if no cached forecast for this location covers it.
+        at = time.time() if at is None else at
+        location = normalize_location(location)
+        with self._lock:
+            entries = [self._lookup(key) for key in list(self._cache) if key[0] == "forecast.json" and key[1] == location]
+        for entry in entries:
+            if entry is None:
+                continue
+            data = entry[1]
+            for day in data.get("forecast", {}).get("forecastday", []):
+                for hour in day.get("hour") or []:
+                    if hour["time_epoch"] <= at < hour["time_epoch"] + 3600:
+                        return {"location": data["location"], "current": {**hour, "last_updated_epoch": hour["time_epoch"]},
+                                "forecast_hour": True}
+        return None
+
+    def _fetch(self, key, location, endpoint, params, wait=True):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if owner:
+            if wait:
+                self._load(key, future, location, endpoint, params)
+            else:
+                threading.Thread(target=self._load, args=(key, future, location, endpoint, params),
+                                 name="weather-refresh", daemon=True).start()
+        return future.result() if wait else None
+
+    def _load(self, key, future, location, endpoint, params):
+        try:
+            with span("weather.fetch", location=key[1], endpoint=endpoint):
+                data = self.provider.fetch(location, endpoint, **params)
+        except Exception as e:
+            data = {"error": f"Unexpected error: {e}"}
+        with self._lock:
+            if "error" not in data:
+                self._store(key, (time.time(), data))
+            self._inflight.pop(key, None)
+        future.set_result(data)
+
+    def put(self, location, data, endpoint="current.json", fetched_at=None, **params):
+        with self._lock:
+            self._store(self._key(location, endpoint, params), (fetched_at or time.time(), data))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_weather_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            if os.getenv("WEATHER_PROVIDER") == "fake":
+                provider = FakeWeatherProvider()
+            else:
+                provider = WeatherApiProvider()
+            _client = WeatherClient(provider)
+        return _client
+
+
+def set_weather_provider(provider, **kwargs):
+    global _client
+    with _client_lock:
+        _client = WeatherClient(provider, **kwargs)
+    return _client
+
+
+def weather_available():
+    return bool(os.getenv("WEATHER_API_KEY")) or os.getenv("WEATHER_PROVIDER") == "fake"
+
+
+def weather_inputs(data):
+    # The weather fields the agent and task prompts are filled with.
+    current = data["current"]
+    return {
+        "Temperature": current["temp_c"],
+        "Condition": current["condition"]["text"],
+        "Humidity": current["humidity"],
+        "Wind": f"{current['wind_kph']} kph {current['wind_dir']}",
+        "UV_index": current["uv"],
+    }
+
+
+class LookupCounts:
+    # Lookups per location in hourly buckets, kept for `window` seconds.
+
+    def __init__(self, window=WEATHER_PREFETCH_WINDOW):
+        self.window = window
+        self._hours = {}
+        self._lock = threading.Lock()
+
+    def add(self, location, at=None):
+        at = time.time() if at is None else at
+        if not location or at < time.time() - self.window:
+            return
+        with self._lock:
+            self._hours.setdefault(int(at // 3600), Counter())[location] += 1
+
+    def most_common(self, limit=None):
+        oldest = int((time.time() - self.window) // 3600)
+        total = Counter()
+        with self._lock:
+            for hour in [hour for hour in self._hours if hour < oldest]:
+                del self._hours[hour]
+            for counts in self._hours.values():
+                total.update(counts)
+        return total.most_common(limit)
+
+
+# Every user lookup in this process, whether or not traces are exported
+weather_lookups = LookupCounts()
 
-weather_api = os.getenv("WEATHER_API_KEY")
 
 def get_weather(location):
-    if not weather_api:
-        return {"error": "Weather API key not configured"}
+    key = normalize_location(location)
+    weather_lookups.add(key)
+    with span("weather", location=key) as record:
+        client = get_weather_client()
+        if client.age(location) is None:
+            # Not cached: a prefetched forecast for this hour answers now while current conditions load
+            data = client.forecast_hour(location)
+            if data is not None:
+                record["attributes"]["source"] = "forecast"
+                client.refresh(location, wait=False)
+                return data
+        return client.get(location)
+
+
+def _band(value, width):
     try:
-        base_url = f"http://api.weatherapi.com/v1/current.json?key={weather_api}&q={location}&aqi=no"
-        response = requests.get(base_url, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Unable to fetch data: {response.status_code} - {response.text}"}
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Network error: {e}"}
-    except Exception as e:
-        return {"error": f"Unexpected error: {e}"}
\ No newline at end of file
+        low = int(float(value) // width * width)
+    except (TypeError, ValueError):
+        return "unknown"
+    return f"{low}-{low + width}"
+
+
+def bucket_weather(Temperature=None, Humidity=None, Condition=None, Wind=None, UV_index=None):
+    # Coarse weather bands: advice for 21°C and 23°C is the same advice.
+    wind_speed = str(Wind).split()[0] if Wind else None
+    return {
+        "Temperature": _band(Temperature, 5),
+        "Humidity": _band(Humidity, 20),
+        "Condition": " ".join(str(Condition or "unknown").lower().split()),
+        "Wind": _band(wind_speed, 10),
+        "UV_index": _band(UV_index, 3),
+    }